@@ -1,6 +1,12 @@
 import pandas as pd
 from sqlalchemy import create_engine, inspect
 import datetime
+import os
+import sys
+
+# Shared COPY-based reader lives with the pipeline scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from pg_copy_reader import read_sql_pandas
 
 # 1. Connection to PostgreSQL
 DB_PARAMS = {
@@ -40,7 +46,7 @@ def run_initial_validation():
     print(f"\n[STEP 4] Row Counts (Source Data Volume):")
     row_data = []
     for table in found:
-        count = pd.read_sql(f"SELECT COUNT(*) FROM {table}", engine).iloc[0, 0]
+        count = read_sql_pandas(f"SELECT COUNT(*) FROM {table}", engine).iloc[0, 0]
         row_data.append({"Table Name": table, "Total Rows": count})
     
     df_rows = pd.DataFrame(row_data)
@@ -50,7 +56,7 @@ def run_initial_validation():
     print(f"\n[STEP 5] Data Quality Issues Identification:")
     if 'rental' in all_tables:
         # Check for missing return dates
-        df_rental = pd.read_sql("SELECT rental_date, return_date FROM rental", engine)
+        df_rental = read_sql_pandas("SELECT rental_date, return_date FROM rental", engine)
         nulls = df_rental['return_date'].isnull().sum()
         print(f"- Missing Data: {nulls} records in 'rental' have no 'return_date' (Active rentals).")
         # Check for date consistency
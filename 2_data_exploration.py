@@ -1,6 +1,11 @@
-import pandas as pd
 from sqlalchemy import create_engine
 import numpy as np
+import os
+import sys
+
+# Shared COPY-based reader lives with the pipeline scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from pg_copy_reader import read_sql_pandas
 
 # Connexion à la base de données restaurée
 # Adapte le host si tu es sur Docker (localhost ou postgres)
@@ -15,7 +20,7 @@ def run_consistent_eda():
     # 1. ANALYSE FINANCIÈRE (Table Payment)
     print("\n💰 [FINANCE] Revenue & Pricing Analysis")
     try:
-        df_pay = pd.read_sql("SELECT amount, payment_date FROM payment", engine)
+        df_pay = read_sql_pandas("SELECT amount, payment_date FROM payment", engine)
         stats = {
             "Total Revenue": f"{df_pay['amount'].sum():,.2f} $",
             "Average Ticket": f"{df_pay['amount'].mean():.2f} $",
@@ -33,7 +38,7 @@ def run_consistent_eda():
         SELECT rating, rental_rate, replacement_cost, length 
         FROM film
         """
-        df_film = pd.read_sql(query_film, engine)
+        df_film = read_sql_pandas(query_film, engine)
         print(f"  - Average Movie Length: {df_film['length'].mean():.1f} min")
         print(f"  - Replacement Cost Risk: {df_film['replacement_cost'].sum():,.0f} $ (Total Asset Value)")
         print(f"  - Rating Distribution:\n{df_film['rating'].value_counts(normalize=True).mul(100).round(1).astype(str) + '%'}")
@@ -48,7 +53,7 @@ def run_consistent_eda():
         FROM rental 
         GROUP BY day_of_week
         """
-        df_rent = pd.read_sql(query_rental, engine)
+        df_rent = read_sql_pandas(query_rental, engine)
         # 0 = Sunday, 6 = Saturday
         peak_day = df_rent.loc[df_rent['total'].idxmax(), 'day_of_week']
         print(f"  - Peak Activity Day: Day {int(peak_day)} (Weekly cycle detected)")
@@ -58,8 +63,8 @@ def run_consistent_eda():
     print("\n🛡️ [INTEGRITY] Global Quality Audit")
     tables = ["customer", "address", "city", "country"]
     for t in tables:
-        count = pd.read_sql(f"SELECT count(*) FROM {t}", engine).iloc[0,0]
-        nulls = pd.read_sql(f"SELECT count(*) FROM {t} WHERE {t}_id IS NULL", engine).iloc[0,0]
+        count = read_sql_pandas(f"SELECT count(*) FROM {t}", engine).iloc[0,0]
+        nulls = read_sql_pandas(f"SELECT count(*) FROM {t} WHERE {t}_id IS NULL", engine).iloc[0,0]
         status = "✅ CLEAN" if nulls == 0 else "⚠️ WARNING (Nulls detected)"
         print(f"  - Table {t:10} | Records: {count:4} | Status: {status}")
 
@@ -1,8 +1,13 @@
 import pandas as pd
 import s3fs
 import os
+import sys
 from dotenv import load_dotenv
 
+# Shared bronze dataset reader lives with the pipeline scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from bronze_dataset import read_bronze_table
+
 # 1. Setup
 load_dotenv()
 fs = s3fs.S3FileSystem(
@@ -13,6 +18,9 @@ fs = s3fs.S3FileSystem(
 
 BRONZE_PATH = f"s3://{os.getenv('BRONZE_BUCKET')}/dvdrental/"
 SILVER_EXPORT_PATH = "exports/tables/"
+# Optional YYYY-MM lower bound: only rentals from this month on are read
+# (whole month partitions are pruned on the partitioned bronze layout)
+BRONZE_SINCE = os.getenv("BRONZE_SINCE")
 
 def build_silver_layer():
     print("="*60)
@@ -25,10 +33,14 @@ def build_silver_layer():
     try:
         # 2. Loading Core Tables
         print("📥 Loading tables from Bronze (MinIO)...")
-        rental = pd.read_parquet(f"{BRONZE_PATH}rental.parquet", filesystem=fs)
-        inventory = pd.read_parquet(f"{BRONZE_PATH}inventory.parquet", filesystem=fs)
-        film = pd.read_parquet(f"{BRONZE_PATH}film.parquet", filesystem=fs)
-        customer = pd.read_parquet(f"{BRONZE_PATH}customer.parquet", filesystem=fs)
+        rental = read_bronze_table(fs, "rental", since=BRONZE_SINCE, bronze_path=BRONZE_PATH)
+        inventory = read_bronze_table(fs, "inventory", bronze_path=BRONZE_PATH)
+        film = read_bronze_table(fs, "film", bronze_path=BRONZE_PATH)
+        customer = read_bronze_table(
+            fs, "customer",
+            columns=['customer_id', 'first_name', 'last_name', 'email'],
+            bronze_path=BRONZE_PATH
+        )
 
         # 3. Data Cleaning & Handling Missing Values
         print("🧹 Cleaning data and handling NULLs...")
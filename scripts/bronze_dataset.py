@@ -0,0 +1,66 @@
+"""
+bronze_dataset.py
+-----------------
+Read access to the Bronze layer through the pyarrow dataset API.
+
+Bronze tables are stored either as one Parquet object
+(s3://bronze/dvdrental/<table>.parquet) or, for the large time-based tables
+extracted with BRONZE_PARTITIONED=true, as a Hive-style dataset partitioned
+by month (s3://bronze/dvdrental/<table>/month=YYYY-MM/part-0.parquet).
+
+read_bronze_table() hides the difference: columns are projected and a
+`since` filter is pushed down, which prunes whole month partitions on the
+partitioned layout and skips row groups (min/max stats) on the flat one.
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+BRONZE_PATH = "s3://bronze/dvdrental/"
+
+# Time-based tables that can be month-partitioned, and their date column
+PARTITIONED_TABLES = {
+    "rental": "rental_date",
+    "payment": "payment_date",
+}
+PARTITION_COLUMN = "month"
+PARTITIONING = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive")
+
+
+def _strip_scheme(path: str) -> str:
+    return path.replace("s3://", "", 1).rstrip("/")
+
+
+def bronze_dataset(fs, table_name: str, bronze_path: str = BRONZE_PATH) -> ds.Dataset:
+    """Open a bronze table as a dataset, partitioned directory or single file."""
+    base = _strip_scheme(f"{bronze_path}{table_name}")
+    if fs.isdir(base):
+        return ds.dataset(base, filesystem=fs, format="parquet", partitioning=PARTITIONING)
+    return ds.dataset(f"{base}.parquet", filesystem=fs, format="parquet")
+
+
+def since_filter(dataset: ds.Dataset, table_name: str, since: str):
+    """
+    Filter expression keeping rows from month `since` (YYYY-MM) onwards.
+    Uses the partition key when present so untouched months are never opened.
+    """
+    if since is None or table_name not in PARTITIONED_TABLES:
+        return None
+    if PARTITION_COLUMN in dataset.schema.names:
+        return ds.field(PARTITION_COLUMN) >= since
+    return ds.field(PARTITIONED_TABLES[table_name]) >= pd.Timestamp(f"{since}-01")
+
+
+def read_bronze_table(fs, table_name: str, columns=None, since: str = None,
+                      bronze_path: str = BRONZE_PATH) -> pd.DataFrame:
+    """
+    Load one bronze table with column projection and optional month filter.
+    The partition key column is dropped unless explicitly requested.
+    """
+    dataset = bronze_dataset(fs, table_name, bronze_path)
+    if columns is None:
+        columns = [c for c in dataset.schema.names if c != PARTITION_COLUMN]
+
+    table = dataset.to_table(columns=columns, filter=since_filter(dataset, table_name, since))
+    return table.to_pandas()
@@ -8,12 +8,36 @@ Features:
 - Adds ingestion metadata
 - Dynamically creates the bucket if it does not exist
 - One table = one Parquet file
+- Incremental mode (EXTRACT_MODE=incremental): per-table high-water mark,
+  only rows changed since the last run are pulled and written as append files.
+  Each run re-reads EXTRACT_OVERLAP_SECONDS before the mark, so rows that
+  committed late with an older timestamp are still picked up; the re-read
+  duplicates are dropped by primary key in Silver (latest ingestion wins).
+  Deletes are not propagated: a deleted row stays in Bronze until the next
+  full snapshot
+- Streaming mode (EXTRACT_STREAMING=true): server-side cursor read in
+  fixed-size batches, one Parquet row group per batch, constant memory
+- Concurrent extraction (EXTRACT_WORKERS): tables run in parallel over a
+  bounded connection pool, largest tables first, with per-table stats
+- Partitioned layout (BRONZE_PARTITIONED=true): rental / payment written as
+  dvdrental/<table>/month=YYYY-MM/ datasets (see bronze_dataset.py)
+- Safe publish: files are written under _staging/ and moved into place
+  only once complete; a failed extract leaves the previous snapshot intact
 """
 
 import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-from sqlalchemy import create_engine
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+from pg_copy_reader import read_sql_pandas
+from bronze_dataset import PARTITIONED_TABLES, PARTITION_COLUMN, PARTITIONING
 from datetime import datetime, timezone
 import s3fs
 
@@ -32,10 +56,40 @@ PG_URI = (
 BRONZE_BUCKET = os.getenv("BRONZE_BUCKET")
 BRONZE_PATH = f"s3://{BRONZE_BUCKET}/dvdrental/"
 
+# Incremental extraction: append files and watermark state live next to
+# (not inside) dvdrental/ so readers listing that prefix are unaffected.
+EXTRACT_MODE = os.getenv("EXTRACT_MODE", "full")   # full | incremental
+INCREMENTAL_PATH = f"s3://{BRONZE_BUCKET}/dvdrental_incremental/"
+STATE_PATH = f"s3://{BRONZE_BUCKET}/_state/dvdrental_watermarks.json"
+# Re-read window before the watermark (transactions that committed late
+# with an older last_update / payment_date)
+EXTRACT_OVERLAP_SECONDS = int(os.getenv("EXTRACT_OVERLAP_SECONDS", "300"))
+
+# Files are written here first and only moved under dvdrental/ (or
+# dvdrental_incremental/) once complete, so a failed run never publishes
+# a truncated file
+STAGING_PATH = f"s3://{BRONZE_BUCKET}/_staging/dvdrental/"
+
+# Streaming extraction: rows per server-side cursor fetch / Parquet row group
+EXTRACT_STREAMING = os.getenv("EXTRACT_STREAMING", "false").lower() == "true"
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "50000"))
+
+# Hive-style month partitions for rental / payment instead of one object
+BRONZE_PARTITIONED = os.getenv("BRONZE_PARTITIONED", "false").lower() == "true"
+
+# Number of tables extracted concurrently (1 = serial)
+EXTRACT_WORKERS = max(1, int(os.getenv("EXTRACT_WORKERS", "4")))
+
 # ----------------------------
 # PostgreSQL connection
 # ----------------------------
-engine = create_engine(PG_URI)
+# Bounded pool: one connection per extraction worker, no overflow
+engine = create_engine(
+    PG_URI,
+    pool_size=EXTRACT_WORKERS,
+    max_overflow=0,
+    pool_pre_ping=True,
+)
 
 # ----------------------------
 # Tables to extract
@@ -47,6 +101,29 @@ TABLES = [
     "staff", "store"
 ]
 
+# Column used as high-water mark for each table. Every dvdrental table has
+# `last_update` except payment. Rental also uses `last_update` rather than
+# `rental_date` so that returns (return_date filled later) are picked up.
+WATERMARK_COLUMNS = {
+    table: "last_update" for table in TABLES
+}
+WATERMARK_COLUMNS["payment"] = "payment_date"
+
+# Postgres -> Arrow types for the streaming writer (numeric and timestamptz
+# are handled in pg_type_to_arrow; anything unlisted is written as string)
+PG_ARROW_TYPES = {
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "real": pa.float32(),
+    "double precision": pa.float64(),
+    "boolean": pa.bool_(),
+    "date": pa.date32(),
+    "timestamp without time zone": pa.timestamp("us"),
+    "bytea": pa.binary(),
+    "ARRAY": pa.list_(pa.string()),
+}
+
 # ----------------------------
 # Check and create bucket
 # ----------------------------
@@ -59,41 +136,511 @@ if not fs.exists(BRONZE_BUCKET):
 else:
     print(f"✅ Bucket '{BRONZE_BUCKET}' exists.")
 
+# ----------------------------
+# Watermark state
+# ----------------------------
+def load_state() -> dict:
+    """Read the per-table watermark state from the bronze bucket."""
+    if not fs.exists(STATE_PATH):
+        return {}
+    with fs.open(STATE_PATH, "r") as f:
+        return json.load(f)
+
+
+def save_state(state: dict):
+    with fs.open(STATE_PATH, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def get_change_counters() -> dict:
+    """
+    Cumulative insert/update/delete counters per table from
+    pg_stat_user_tables. A table whose counter has not moved since the
+    last run has no changes to extract.
+    """
+    query = text(
+        "SELECT relname, n_tup_ins + n_tup_upd + n_tup_del AS n_changes "
+        "FROM pg_stat_user_tables WHERE schemaname = 'public'"
+    )
+    with engine.connect() as conn:
+        return {row.relname: int(row.n_changes) for row in conn.execute(query)}
+
+
+def add_metadata(df: pd.DataFrame) -> pd.DataFrame:
+    df["_ingestion_timestamp"] = datetime.now(timezone.utc)
+    df["_source_system"] = "postgres.dvdrental"
+    return df
+
+
+def max_watermark(df: pd.DataFrame, column: str):
+    if df.empty or df[column].isna().all():
+        return None
+    return pd.Timestamp(df[column].max()).isoformat()
+
+
+# ----------------------------
+# Streaming helpers
+# ----------------------------
+def pg_type_to_arrow(data_type: str, precision, scale) -> pa.DataType:
+    """Map an information_schema data_type to the Arrow type written to Parquet."""
+    if data_type == "numeric":
+        # Same rule as pg_copy_reader: unconstrained numeric -> float64
+        # (stream_query_to_parquet converts the Decimal values)
+        if precision is None or int(precision) > 38:
+            return pa.float64()
+        return pa.decimal128(int(precision), int(scale or 0))
+    if data_type == "timestamp with time zone":
+        return pa.timestamp("us", tz="UTC")
+    return PG_ARROW_TYPES.get(data_type, pa.string())
+
+
+def get_arrow_schema(table_name: str) -> pa.Schema:
+    """
+    Build the Parquet schema from the Postgres catalog so every batch is
+    written with the same types (inferring per batch would drift, e.g. on
+    all-NULL batches or decimal precision).
+    """
+    query = text(
+        "SELECT column_name, data_type, numeric_precision, numeric_scale "
+        "FROM information_schema.columns "
+        "WHERE table_schema = 'public' AND table_name = :table "
+        "ORDER BY ordinal_position"
+    )
+    with engine.connect() as conn:
+        rows = conn.execute(query, {"table": table_name}).fetchall()
+
+    fields = [
+        pa.field(r.column_name, pg_type_to_arrow(r.data_type, r.numeric_precision, r.numeric_scale))
+        for r in rows
+    ]
+    fields += [
+        pa.field("_ingestion_timestamp", pa.timestamp("us", tz="UTC")),
+        pa.field("_source_system", pa.string()),
+    ]
+    return pa.schema(fields)
+
+
+def stream_query_to_parquet(query, output_path: str, schema: pa.Schema,
+                            watermark_column: str, params=None,
+                            write_empty: bool = True, partition_by: str = None):
+    """
+    Read `query` through a named server-side cursor in batches of
+    STREAM_BATCH_SIZE rows and write each batch as one Parquet row group
+    straight to the MinIO object. Memory stays bounded by one batch.
+
+    With `partition_by` (a timestamp column the query is ordered by),
+    `output_path` is a directory and rows go to Hive-style
+    month=YYYY-MM/ partitions, with one writer open at a time.
+
+    Returns (row_count, max watermark value as ISO string or None).
+    """
+    ingestion_ts = datetime.now(timezone.utc)
+    n_rows = 0
+    watermark = None
+    f = None
+    writer = None
+    current_path = None
+
+    def write(batch: pa.Table, path: str):
+        nonlocal f, writer, current_path
+        if path != current_path:
+            if writer is not None:
+                writer.close()
+                f.close()
+            f = fs.open(path, "wb")
+            writer = pq.ParquetWriter(f, schema)
+            current_path = path
+        writer.write_table(batch)
+
+    try:
+        # stream_results=True makes psycopg2 use a named (server-side) cursor
+        with engine.connect().execution_options(
+            stream_results=True, max_row_buffer=STREAM_BATCH_SIZE
+        ) as conn:
+            result = conn.execute(query, params or {})
+
+            while True:
+                rows = result.fetchmany(STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+
+                columns = list(zip(*rows))
+                n = len(rows)
+                arrays = [
+                    pa.array(to_float(values) if pa.types.is_floating(field.type) else values,
+                             type=field.type)
+                    for values, field in zip(columns, schema)
+                ]
+                arrays.append(pa.array([ingestion_ts] * n, type=schema.field("_ingestion_timestamp").type))
+                arrays.append(pa.array(["postgres.dvdrental"] * n, type=pa.string()))
+                batch = pa.Table.from_arrays(arrays, schema=schema)
+
+                if partition_by is None:
+                    write(batch, output_path)
+                else:
+                    months = pc.fill_null(
+                        pc.strftime(batch.column(partition_by), format="%Y-%m"),
+                        "__HIVE_DEFAULT_PARTITION__",
+                    )
+                    # Input is ordered by partition_by, so months arrive in sequence
+                    for month in pc.unique(months).to_pylist():
+                        part = batch.filter(pc.equal(months, month))
+                        write(part, f"{output_path}{PARTITION_COLUMN}={month}/part-0.parquet")
+
+                batch_max = pc.max(batch.column(watermark_column)).as_py()
+                if batch_max is not None and (watermark is None or batch_max > watermark):
+                    watermark = batch_max
+                n_rows += n
+
+        if writer is None and write_empty and partition_by is None:
+            write(schema.empty_table(), output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if f is not None:
+            f.close()
+
+    return n_rows, (pd.Timestamp(watermark).isoformat() if watermark is not None else None)
+
+
+def to_float(values) -> list:
+    """psycopg2 returns unconstrained numeric as Decimal, which Arrow won't cast to double."""
+    return [None if v is None else float(v) for v in values]
+
+
+def write_partitioned(df: pd.DataFrame, output_path: str, partition_by: str):
+    """Write a DataFrame as a Hive-style month-partitioned dataset."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    months = pc.fill_null(
+        pc.strftime(table.column(partition_by), format="%Y-%m"),
+        "__HIVE_DEFAULT_PARTITION__",
+    )
+    table = table.append_column(PARTITION_COLUMN, months)
+
+    ds.write_dataset(
+        table,
+        base_dir=output_path.replace("s3://", "", 1).rstrip("/"),
+        filesystem=fs,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+    )
+
+
+def staging_path(table_name: str, partitioned: bool = False) -> str:
+    """Fresh staging location (file, or directory when partitioned) for one write."""
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    return f"{STAGING_PATH}{table_name}_{run_id}" + ("/" if partitioned else ".parquet")
+
+
+def discard(path: str):
+    """Remove a staged file or directory left behind by a failed write."""
+    try:
+        if fs.exists(path):
+            fs.rm(path, recursive=True)
+    except Exception as e:
+        print(f"⚠️  Could not remove staged {path}: {e}")
+
+
+def publish(staged_path: str, output_path: str) -> set:
+    """
+    Move a completely written file (or directory) from staging to
+    `output_path`, overwriting objects with the same key. Returns the
+    published keys.
+    """
+    src = staged_path.replace("s3://", "", 1).rstrip("/")
+    dst = output_path.replace("s3://", "", 1).rstrip("/")
+    fs.invalidate_cache(src)
+    if not fs.exists(src):
+        return set()    # nothing was written (e.g. empty partitioned table)
+    keys = fs.find(src) if fs.isdir(src) else [src]
+    published = set()
+    for key in keys:
+        target = dst + key[len(src):]
+        fs.mv(key, target)
+        published.add(target)
+    fs.invalidate_cache()
+    return published
+
+
+def publish_snapshot(table_name: str, staged_path: str, output_path: str):
+    """
+    Replace a table's full snapshot by the staged one. The old snapshot
+    is only removed after the new one is in place: objects the new one
+    did not overwrite (other layout, months that are gone) are deleted last.
+    """
+    single = f"{BRONZE_PATH}{table_name}.parquet".replace("s3://", "", 1)
+    directory = f"{BRONZE_PATH}{table_name}".replace("s3://", "", 1)
+    previous = set()
+    if fs.exists(single):
+        previous.add(single)
+    if fs.isdir(directory):
+        previous.update(fs.find(directory))
+
+    published = publish(staged_path, output_path)
+
+    for key in previous - published:
+        fs.rm(key)
+
+
 # ----------------------------
 # Extraction function
 # ----------------------------
 def extract_table(table_name: str):
+    """Full snapshot of a table. Returns (row_count, max watermark, bytes written)."""
     print(f"📥 Extracting table: {table_name}")
 
-    # Read table from PostgreSQL
-    df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
+    column = WATERMARK_COLUMNS[table_name]
+    partition_by = PARTITIONED_TABLES.get(table_name) if BRONZE_PARTITIONED else None
 
-    # Add metadata
-    df["_ingestion_timestamp"] = datetime.now(timezone.utc)
-    df["_source_system"] = "postgres.dvdrental"
+    # Output path: one object, or a month-partitioned directory
+    if partition_by:
+        output_path = f"{BRONZE_PATH}{table_name}/"
+    else:
+        output_path = f"{BRONZE_PATH}{table_name}.parquet"
+
+    # Written to staging first; the previous snapshot stays readable until
+    # the new one is complete
+    staged_path = staging_path(table_name, partitioned=bool(partition_by))
+    try:
+        if EXTRACT_STREAMING:
+            schema = get_arrow_schema(table_name)
+            order_by = f" ORDER BY {partition_by}" if partition_by else ""
+            n_rows, watermark = stream_query_to_parquet(
+                text(f"SELECT * FROM {table_name}{order_by}"),
+                staged_path,
+                schema,
+                column,
+                partition_by=partition_by,
+            )
+        else:
+            # Read table from PostgreSQL
+            df = read_sql_pandas(f"SELECT * FROM {table_name}", engine)
+
+            # Add metadata
+            df = add_metadata(df)
+
+            # Save as Parquet to MinIO
+            if partition_by:
+                write_partitioned(df, staged_path, partition_by)
+            else:
+                df.to_parquet(
+                    staged_path,
+                    engine="pyarrow",
+                    index=False
+                )
+            n_rows, watermark = len(df), max_watermark(df, column)
+    except BaseException:
+        discard(staged_path)
+        raise
+
+    publish_snapshot(table_name, staged_path, output_path)
+
+    # A full snapshot supersedes any append files written before it
+    increments_path = f"{INCREMENTAL_PATH}{table_name}/"
+    if fs.exists(increments_path):
+        fs.rm(increments_path, recursive=True)
+
+    print(f"✅ Saved {n_rows} rows to {output_path}")
+    return n_rows, watermark, fs.du(output_path)
+
+
+def extract_table_incremental(table_name: str, watermark: str):
+    """
+    Pull only the rows whose watermark column is newer than `watermark`
+    minus EXTRACT_OVERLAP_SECONDS and write them as a new append file under
+    dvdrental_incremental/. Returns (row_count, max watermark, bytes written).
+    """
+    column = WATERMARK_COLUMNS[table_name]
+    since = (pd.Timestamp(watermark) - pd.Timedelta(seconds=EXTRACT_OVERLAP_SECONDS)).isoformat()
+    print(f"📥 Extracting table: {table_name} ({column} > {since}, watermark {watermark})")
+
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    output_path = f"{INCREMENTAL_PATH}{table_name}/{table_name}_{run_id}.parquet"
+
+    staged_path = staging_path(table_name)
+    try:
+        if EXTRACT_STREAMING:
+            n_rows, new_watermark = stream_query_to_parquet(
+                text(f"SELECT * FROM {table_name} WHERE {column} > :watermark"),
+                staged_path,
+                get_arrow_schema(table_name),
+                column,
+                params={"watermark": since},
+                write_empty=False,
+            )
+        else:
+            df = read_sql_pandas(
+                f"SELECT * FROM {table_name} WHERE {column} > %(watermark)s",
+                engine,
+                params={"watermark": since},
+            )
+            n_rows, new_watermark = len(df), max_watermark(df, column)
+
+            if n_rows:
+                df = add_metadata(df)
+                df.to_parquet(
+                    staged_path,
+                    engine="pyarrow",
+                    index=False
+                )
+    except BaseException:
+        discard(staged_path)
+        raise
+
+    # Overlap rows alone must not move the mark backwards
+    if new_watermark is not None and pd.Timestamp(new_watermark) < pd.Timestamp(watermark):
+        new_watermark = watermark
+
+    if n_rows == 0:
+        print(f"⏭️  No new rows in {table_name}")
+        return n_rows, new_watermark, 0
 
-    # Output path
-    output_path = f"{BRONZE_PATH}{table_name}.parquet"
+    publish(staged_path, output_path)
 
-    # Save as Parquet to MinIO
-    df.to_parquet(
-        output_path,
-        engine="pyarrow",
-        index=False
+    print(f"✅ Appended {n_rows} rows to {output_path}")
+    return n_rows, new_watermark, fs.size(output_path)
+
+
+def get_table_sizes() -> dict:
+    """On-disk size of each table, used to schedule the biggest ones first."""
+    query = text(
+        "SELECT relname, pg_total_relation_size(relid) AS size "
+        "FROM pg_stat_user_tables WHERE schemaname = 'public'"
     )
+    with engine.connect() as conn:
+        return {row.relname: int(row.size) for row in conn.execute(query)}
+
+
+def timed(table_name: str, extract_fn, *args) -> dict:
+    """Run one extraction and collect wall time, rows/s and bytes written."""
+    start = time.perf_counter()
+    n_rows, watermark, n_bytes = extract_fn(table_name, *args)
+    elapsed = time.perf_counter() - start
+    return {
+        "table": table_name,
+        "rows": n_rows,
+        "watermark": watermark,
+        "bytes": n_bytes,
+        "seconds": elapsed,
+        "rows_per_s": n_rows / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def run_tables(jobs: list, on_done) -> list:
+    """
+    Execute (table, extract_fn, args) jobs on EXTRACT_WORKERS threads,
+    biggest tables first so they don't become the long tail. While one
+    worker waits on Postgres, others are uploading to MinIO.
+    `on_done(stats)` is called on the main thread as each table finishes.
+    """
+    sizes = get_table_sizes()
+    jobs = sorted(jobs, key=lambda job: sizes.get(job[0], 0), reverse=True)
+
+    results = []
 
-    print(f"✅ Saved to {output_path}")
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        futures = {
+            executor.submit(timed, table, extract_fn, *args): table
+            for table, extract_fn, args in jobs
+        }
+        for future in as_completed(futures):
+            stats = future.result()
+            on_done(stats)
+            results.append(stats)
+
+    return results
+
+
+def print_report(results: list):
+    if not results:
+        return
+    print("\n📊 Extraction report")
+    print(f"{'table':<15}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'MB':>10}")
+    for r in sorted(results, key=lambda r: r["seconds"], reverse=True):
+        print(
+            f"{r['table']:<15}{r['rows']:>10}{r['seconds']:>10.2f}"
+            f"{r['rows_per_s']:>12.0f}{r['bytes'] / 1e6:>10.2f}"
+        )
+
+
+def run_incremental() -> list:
+    state = load_state()
+    counters = get_change_counters()
+    jobs = []
+
+    for table in TABLES:
+        table_state = state.get(table, {})
+        n_changes = counters.get(table)
+
+        # Counters unchanged since last run -> nothing to query
+        if (
+            table_state.get("watermark") is not None
+            and n_changes is not None
+            and table_state.get("n_changes") == n_changes
+        ):
+            print(f"⏭️  Skipping {table}: no changes since last run")
+            continue
+
+        if table_state.get("watermark") is None:
+            # First run for this table: take a full snapshot as the baseline
+            jobs.append((table, extract_table, ()))
+        else:
+            jobs.append((table, extract_table_incremental, (table_state["watermark"],)))
+
+    def on_done(stats):
+        table = stats["table"]
+        state[table] = {
+            "column": WATERMARK_COLUMNS[table],
+            "watermark": stats["watermark"] or state.get(table, {}).get("watermark"),
+            "n_changes": counters.get(table),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        # Persist after each table so a failure does not lose progress
+        save_state(state)
+
+    return run_tables(jobs, on_done)
+
+
+def run_full() -> list:
+    counters = get_change_counters()
+    state = {}
+
+    def on_done(stats):
+        table = stats["table"]
+        state[table] = {
+            "column": WATERMARK_COLUMNS[table],
+            "watermark": stats["watermark"],
+            "n_changes": counters.get(table),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    results = run_tables([(table, extract_table, ()) for table in TABLES], on_done)
+
+    # Record watermarks so a later incremental run starts from this snapshot
+    save_state(state)
+    return results
 
 
 # ----------------------------
 # Main function
 # ----------------------------
 def main():
-    print("🚀 Starting Bronze extraction")
+    print(
+        f"🚀 Starting Bronze extraction (mode: {EXTRACT_MODE}, "
+        f"streaming: {EXTRACT_STREAMING}, workers: {EXTRACT_WORKERS}, "
+        f"partitioned: {BRONZE_PARTITIONED})"
+    )
+    start = time.perf_counter()
 
-    for table in TABLES:
-        extract_table(table)
+    if EXTRACT_MODE == "incremental":
+        results = run_incremental()
+    else:
+        results = run_full()
 
+    print_report(results)
+    print(f"⏱️  Total wall time: {time.perf_counter() - start:.2f}s")
     print("🎉 Bronze layer successfully created in MinIO")
 
 
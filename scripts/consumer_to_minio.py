@@ -1,9 +1,25 @@
+import io
+import os
+import gzip
 import json
+import time
+import threading
+import socket
+import multiprocessing
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import boto3
 import pandas as pd
-from kafka import KafkaConsumer
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from kafka import KafkaConsumer, ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata, TopicPartition
 from datetime import datetime
 from sqlalchemy import create_engine
+from rental_codec import RentalCodec
+from kpi_state import STATE_TABLES, delta_sql, fold_sql, lock_keys_sql
+from sink_pipeline import CommitCoordinator, SinkWorker, enqueue
 
 # ======================================================
 # 1. CONFIGURATION
@@ -21,10 +37,54 @@ PG_PASSWORD = "postgres"
 PG_HOST = "localhost"
 PG_PORT = "5432"
 PG_DB = "dvdrental"
+# Deadlock / serialization failures are retried (the whole batch transaction)
+PG_RETRY_ATTEMPTS = int(os.getenv("PG_RETRY_ATTEMPTS", "3"))
+PG_RETRY_BACKOFF = float(os.getenv("PG_RETRY_BACKOFF", "0.2"))   # seconds, x attempt
+PG_RETRY_CODES = {"40P01", "40001"}   # deadlock_detected, serialization_failure
 
 # -------- Kafka --------
 KAFKA_TOPIC = "dvd_rentals"
 KAFKA_SERVER = "localhost:9092"
+KAFKA_GROUP_ID = os.getenv("KAFKA_GROUP_ID", "dvd_rentals_consumer")
+
+# -------- Micro-batching --------
+# message = one S3 object + one INSERT per event (original behaviour)
+# batch   = buffer until BATCH_SIZE events or BATCH_LINGER_MS, then one
+#           compressed S3 object + one COPY, offsets committed afterwards
+# pipeline = same batches, but S3 and Postgres are written by separate
+#           threads behind bounded queues (see section 4)
+CONSUMER_MODE = os.getenv("CONSUMER_MODE", "message")
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "500"))
+BATCH_LINGER_MS = int(os.getenv("BATCH_LINGER_MS", "1000"))
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "ndjson")   # ndjson | parquet
+PG_TABLE = "fact_rental_gold"
+
+# -------- Pipelined sinks (CONSUMER_MODE=pipeline) --------
+# Fetch -> [bounded queue] -> S3 writer  \
+#       -> [bounded queue] -> PG writer  -> commit coordinator
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))       # batches per sink queue
+PIPELINE_STATS_INTERVAL = float(os.getenv("PIPELINE_STATS_INTERVAL", "10"))  # seconds
+
+# -------- Consumer group scaling --------
+# batch / pipeline modes join KAFKA_GROUP_ID; CONSUMER_WORKERS processes (or
+# N replicas of the compose service) split the topic's partitions.
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "1"))
+UPSERT_KEY = "rental_id"
+# Insert time of each streamed row (column default, untouched by the ON
+# CONFLICT update): the dashboard's incremental cache fetches rows past it
+INGESTED_COLUMN = "ingested_at"
+
+# -------- Latency metrics --------
+# The producer stamps `_produced_at` (epoch ms); it is kept in the S3 archive
+# but not written to Postgres.
+META_FIELDS = ["_produced_at"]
+METRICS_TABLE = "pipeline_metrics"
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "10"))   # seconds between publishes
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))            # + worker id; 0 disables
+METRICS_WINDOW = 10_000                                          # latency samples kept per stage
+METRICS_RETENTION = "1 day"
+# Identifies this process in pipeline_metrics (workers are spawned, so each gets its own pid)
+WORKER_NAME = f"{socket.gethostname()}-{os.getpid()}"
 
 # ======================================================
 # 2. INITIALIZATION
@@ -41,49 +101,692 @@ s3_client = boto3.client(
 print("🔌 Connecting to PostgreSQL...")
 pg_engine = create_engine(f'postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}')
 
-print("🔌 Connecting to Kafka...")
-consumer = KafkaConsumer(
-    KAFKA_TOPIC,
-    bootstrap_servers=[KAFKA_SERVER],
-    auto_offset_reset='latest',
-    api_version=(0, 10, 1),
-    value_deserializer=lambda x: json.loads(x.decode('utf-8'))
-)
+# Set by create_consumer() in each worker process
+consumer = None
+
+# json and msgpack payloads are both accepted (detected per message)
+codec = RentalCodec()
+
+
+class FlushOnRevoke(ConsumerRebalanceListener):
+    """
+    Before partitions are taken away in a rebalance, flush whatever has been
+    fetched from them and commit, so the next owner starts exactly there.
+    The active loop installs its flush function in `on_revoke`.
+    """
+
+    def __init__(self):
+        self.on_revoke = None
+
+    def on_partitions_revoked(self, revoked):
+        if revoked and self.on_revoke is not None:
+            print(f"🔄 Rebalance: flushing before releasing {len(revoked)} partition(s)")
+            self.on_revoke()
+
+    def on_partitions_assigned(self, assigned):
+        print(f"🧩 Assigned partitions: {sorted(tp.partition for tp in assigned)}")
+
+
+rebalance_listener = FlushOnRevoke()
+
+
+def create_consumer():
+    print("🔌 Connecting to Kafka...")
+    if CONSUMER_MODE in ("batch", "pipeline"):
+        # Offsets are committed by hand once both sinks have the batch
+        # Values stay raw bytes: each batch is decoded at once into Arrow
+        kafka_consumer = KafkaConsumer(
+            bootstrap_servers=[KAFKA_SERVER],
+            group_id=KAFKA_GROUP_ID,
+            enable_auto_commit=False,
+            auto_offset_reset='earliest',
+            max_poll_records=BATCH_SIZE,
+            api_version=(0, 10, 1)
+        )
+        kafka_consumer.subscribe([KAFKA_TOPIC], listener=rebalance_listener)
+        return kafka_consumer
+
+    return KafkaConsumer(
+        KAFKA_TOPIC,
+        bootstrap_servers=[KAFKA_SERVER],
+        auto_offset_reset='latest',
+        api_version=(0, 10, 1),
+        value_deserializer=codec.decode
+    )
+
+
+# ======================================================
+# 3. METRICS
+# ======================================================
+
+class PipelineMetrics:
+    """
+    Latency from produce to fetch / S3 ack / Postgres commit, events/s and
+    consumer lag per partition. Sink threads record, the main thread
+    publishes to the metrics table and serves the Prometheus text format.
+    """
+
+    STAGES = ("fetch", "s3_ack", "pg_commit")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {stage: deque(maxlen=METRICS_WINDOW) for stage in self.STAGES}
+        self.committed = 0
+        self.window_started = time.monotonic()
+        self.lag = {}
+        self.latest = {}
+        self.last_publish = time.monotonic()
+
+    def observe(self, stage, produced_at):
+        """Record latencies for events stamped with `produced_at` epoch ms."""
+        now_ms = time.time() * 1000
+        latencies = [now_ms - t for t in produced_at if t]
+        with self.lock:
+            self.samples[stage].extend(latencies)
+            if stage == "pg_commit":
+                self.committed += len(produced_at)
+
+    def update_lag(self, kafka_consumer):
+        assignment = list(kafka_consumer.assignment())
+        if not assignment:
+            return
+        end_offsets = kafka_consumer.end_offsets(assignment)
+        lag = {tp.partition: max(0, end_offsets[tp] - kafka_consumer.position(tp)) for tp in assignment}
+        with self.lock:
+            self.lag = lag
+
+    def snapshot(self):
+        """Compute the current values and reset the events/s window."""
+        with self.lock:
+            elapsed = time.monotonic() - self.window_started
+            values = {"events_per_s": self.committed / elapsed if elapsed else 0.0}
+            for stage, samples in self.samples.items():
+                ordered = sorted(samples)
+                for q in (50, 95, 99):
+                    if ordered:
+                        k = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+                        values[f"latency_{stage}_ms_p{q}"] = ordered[k]
+            self.committed = 0
+            self.window_started = time.monotonic()
+            self.latest = {"values": values, "lag": dict(self.lag)}
+            return self.latest
+
+    def prometheus_text(self):
+        with self.lock:
+            latest = self.latest
+        lines = [
+            "# HELP dvd_pipeline_latency_ms Produce-to-stage latency in milliseconds",
+            "# TYPE dvd_pipeline_latency_ms summary",
+        ]
+        for name, value in sorted(latest.get("values", {}).items()):
+            if name.startswith("latency_"):
+                stage, quantile = name[len("latency_"):].rsplit("_ms_p", 1)
+                lines.append(
+                    f'dvd_pipeline_latency_ms{{stage="{stage}",quantile="0.{quantile}"}} {value:.3f}'
+                )
+        lines += [
+            "# HELP dvd_pipeline_events_per_second Events committed to Postgres per second",
+            "# TYPE dvd_pipeline_events_per_second gauge",
+            f"dvd_pipeline_events_per_second {latest.get('values', {}).get('events_per_s', 0.0):.3f}",
+            "# HELP dvd_pipeline_consumer_lag Messages behind the end of each partition",
+            "# TYPE dvd_pipeline_consumer_lag gauge",
+        ]
+        for partition, lag in sorted(latest.get("lag", {}).items()):
+            lines.append(f'dvd_pipeline_consumer_lag{{partition="{partition}"}} {lag}')
+        return "\n".join(lines) + "\n"
+
+    def maybe_publish(self, kafka_consumer):
+        """Called from the consumer thread; publishes every METRICS_INTERVAL."""
+        if time.monotonic() - self.last_publish < METRICS_INTERVAL:
+            return
+        self.last_publish = time.monotonic()
+        try:
+            self.update_lag(kafka_consumer)
+            publish_metrics(self.snapshot())
+        except Exception as e:
+            # Metrics must never stop ingestion
+            print(f"⚠️ Metrics publish failed: {e}")
+
+
+metrics = PipelineMetrics()
+
+
+def produced_at_ms(messages):
+    """`_produced_at` of decoded messages, else the Kafka CreateTime."""
+    return [
+        (m.value.get("_produced_at") if isinstance(m.value, dict) else None) or m.timestamp
+        for m in messages
+    ]
+
+
+def ensure_metrics_table():
+    conn = pg_engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {METRICS_TABLE} ("
+                "recorded_at TIMESTAMPTZ NOT NULL DEFAULT now(), "
+                "worker TEXT NOT NULL, "
+                "metric TEXT NOT NULL, "
+                "partition INT, "
+                "value DOUBLE PRECISION)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{METRICS_TABLE}_recorded_at "
+                f"ON {METRICS_TABLE} (recorded_at)"
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def publish_metrics(latest):
+    """Insert one row per metric (long format) and trim old rows."""
+    rows = [(WORKER_NAME, name, None, float(value)) for name, value in latest["values"].items()]
+    rows += [(WORKER_NAME, "consumer_lag", partition, float(lag)) for partition, lag in latest["lag"].items()]
+
+    conn = pg_engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {METRICS_TABLE} (worker, metric, partition, value) VALUES (%s, %s, %s, %s)",
+                rows
+            )
+            cursor.execute(
+                f"DELETE FROM {METRICS_TABLE} WHERE recorded_at < now() - interval '{METRICS_RETENTION}'"
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(worker_id):
+    if not METRICS_PORT:
+        return
+    port = METRICS_PORT + worker_id
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics endpoint: http://localhost:{port}/metrics")
+
+
+# ======================================================
+# 4. BATCH SINKS
+# ======================================================
+
+class RentalBatch:
+    """One flush worth of Kafka messages, decoded once into an Arrow table."""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.table = codec.decode_batch([m.value for m in messages])
+        self.partitions = pa.array([m.partition for m in messages], type=pa.int32())
+
+        # Produce time: the producer's stamp when present, else Kafka CreateTime
+        stamped = (
+            self.table.column("_produced_at").to_pylist()
+            if "_produced_at" in self.table.column_names else [None] * len(messages)
+        )
+        self.produced_at = [t or m.timestamp for t, m in zip(stamped, messages)]
+
+    def __len__(self):
+        return len(self.messages)
+
+
+def archive_key(partition, offsets):
+    """
+    Deterministic object key from the partition and offset range, so a batch
+    redelivered after a crash or rebalance overwrites its own archive.
+    """
+    first, last = min(offsets), max(offsets)
+    extension = "parquet" if ARCHIVE_FORMAT == "parquet" else "ndjson.gz"
+    return f"streamed_data/partition={partition}/rentals_{first:012d}-{last:012d}.{extension}"
+
+
+def archive_batch(batch):
+    """Write a batch as one compressed object per partition under streamed_data/."""
+    keys = []
+    for partition in pc.unique(batch.partitions).to_pylist():
+        mask = pc.equal(batch.partitions, partition)
+        part = batch.table.filter(mask)
+        offsets = [m.offset for m in batch.messages if m.partition == partition]
+        file_key = archive_key(partition, offsets)
+
+        if ARCHIVE_FORMAT == "parquet":
+            buffer = io.BytesIO()
+            pq.write_table(part, buffer, compression="snappy")
+            body = buffer.getvalue()
+        else:
+            ndjson = part.to_pandas().to_json(orient="records", lines=True)
+            body = gzip.compress(ndjson.encode("utf-8"))
+
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=file_key, Body=body)
+        keys.append(file_key)
+
+    metrics.observe("s3_ack", batch.produced_at)
+    return keys
+
+
+# Set once the target table is ready for the upsert (see ensure_upsert_key)
+upsert_key_ready = False
+
+
+def ensure_upsert_key(df):
+    """
+    Prepare the target table on the first write of this process. It is
+    created from the batch's columns when missing (the original consumer
+    created it lazily through to_sql). ON CONFLICT (rental_id) needs a
+    unique index: rows duplicated by earlier producers are removed first,
+    keeping the last inserted. Also adds ingested_at (NULL for rows loaded
+    from Gold, now() for new ones).
+    """
+    global upsert_key_ready
+    if upsert_key_ready:
+        return
+    index_name = f"ux_{PG_TABLE}_{UPSERT_KEY}"
+    conn = pg_engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            # Workers start together: one prepares the table, the others wait for it
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (PG_TABLE,))
+            ddl = pd.io.sql.get_schema(df, PG_TABLE, con=pg_engine)
+            cursor.execute(ddl.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+
+            cursor.execute(
+                "SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s",
+                (PG_TABLE, index_name)
+            )
+            if cursor.fetchone() is None:
+                cursor.execute(
+                    f"DELETE FROM {PG_TABLE} a USING {PG_TABLE} b "
+                    f"WHERE a.{UPSERT_KEY} = b.{UPSERT_KEY} AND a.ctid < b.ctid"
+                )
+                if cursor.rowcount:
+                    print(f"⚠️ Removed {cursor.rowcount} duplicate {UPSERT_KEY} row(s) from {PG_TABLE} (kept the last inserted)")
+                cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {PG_TABLE} ({UPSERT_KEY})")
+
+            cursor.execute(f"ALTER TABLE {PG_TABLE} ADD COLUMN IF NOT EXISTS {INGESTED_COLUMN} TIMESTAMPTZ")
+            cursor.execute(f"ALTER TABLE {PG_TABLE} ALTER COLUMN {INGESTED_COLUMN} SET DEFAULT now()")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{PG_TABLE}_{INGESTED_COLUMN} "
+                f"ON {PG_TABLE} ({INGESTED_COLUMN})"
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    upsert_key_ready = True
+
+
+# KPI states present in Postgres (loaded from Gold), resolved once per process
+kpi_state_kpis = None
+
+
+def folded_kpis(cursor):
+    """KPIs whose partial-state table exists and can be folded into."""
+    global kpi_state_kpis
+    if kpi_state_kpis is None:
+        cursor.execute(
+            "SELECT relname FROM pg_class WHERE relname = ANY(%s) AND relkind = 'r'",
+            (list(STATE_TABLES.values()),)
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        kpi_state_kpis = [kpi for kpi, table in STATE_TABLES.items() if table in existing]
+        if len(kpi_state_kpis) < len(STATE_TABLES):
+            print(f"⚠️ KPI state tables missing (load Gold first), folding only: {kpi_state_kpis}")
+    return kpi_state_kpis
+
+
+def add_date_key(df):
+    """Same YYYYMMDD key as save_gold.py, so streamed rows join dim_time."""
+    if "rental_date" in df.columns:
+        dates = pd.to_datetime(df["rental_date"], errors="coerce")
+        df["date_key"] = (dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).astype("Int32")
+    return df
+
+
+def upsert_to_postgres(df):
+    """
+    Load rows into fact_rental_gold: one COPY into a temp staging table,
+    then a single INSERT ... ON CONFLICT (rental_id) DO UPDATE so a replayed
+    batch can't create duplicates. In the same transaction the rows are
+    folded into the live KPI summary tables (gold_kpi_*_state: per category,
+    day, title, customer and global), so they never disagree with the fact.
+
+    The batch's keys are locked before the delta is read, and rows are
+    written in key order; a deadlock or serialization failure against
+    another consumer rolls back and retries the whole transaction.
+    """
+    # A key may appear twice in one batch; ON CONFLICT can't touch a row twice
+    df = df.drop_duplicates(subset=[UPSERT_KEY], keep="last")
+    ensure_upsert_key(df)
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    payload = buffer.getvalue()
+
+    columns = ", ".join(f'"{c}"' for c in df.columns)
+    updates = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in df.columns if c != UPSERT_KEY)
+    for attempt in range(1, PG_RETRY_ATTEMPTS + 1):
+        conn = pg_engine.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TEMP TABLE _stage_{PG_TABLE} "
+                    f"(LIKE {PG_TABLE} INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                cursor.copy_expert(
+                    f"COPY _stage_{PG_TABLE} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                    io.StringIO(payload)
+                )
+                # Before the upsert: the previous versions are still there to retract.
+                # Keys locked first, so no other consumer retracts the same version
+                kpis = folded_kpis(cursor)
+                if kpis:
+                    cursor.execute(lock_keys_sql(f"_stage_{PG_TABLE}", PG_TABLE))
+                    cursor.execute(delta_sql(f"_stage_{PG_TABLE}", PG_TABLE, list(df.columns)))
+                    for kpi in kpis:
+                        cursor.execute(fold_sql(kpi))
+                cursor.execute(
+                    f"INSERT INTO {PG_TABLE} ({columns}) "
+                    f"SELECT {columns} FROM _stage_{PG_TABLE} "
+                    f"ORDER BY {UPSERT_KEY} "
+                    f"ON CONFLICT ({UPSERT_KEY}) DO UPDATE SET {updates}"
+                )
+            conn.commit()
+            return
+        except Exception as e:
+            conn.rollback()
+            if getattr(e, "pgcode", None) not in PG_RETRY_CODES or attempt == PG_RETRY_ATTEMPTS:
+                raise
+            print(f"⚠️ Postgres {e.pgcode} on attempt {attempt}/{PG_RETRY_ATTEMPTS}, retrying the batch")
+            time.sleep(PG_RETRY_BACKOFF * attempt)
+        finally:
+            conn.close()
+
+
+# Arrow ints -> pandas nullable ints: a NULL would otherwise turn the column
+# into float64 and the CSV into "5.0", which COPY rejects for an integer column
+NULLABLE_INT_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+}
+
+
+def copy_batch_to_postgres(batch):
+    df = batch.table.to_pandas(types_mapper=NULLABLE_INT_TYPES.get)
+    df = df.drop(columns=[c for c in META_FIELDS if c in df.columns])
+    upsert_to_postgres(add_date_key(df))
+    metrics.observe("pg_commit", batch.produced_at)
+
+
+def flush_batch(messages):
+    """Send one batch to both sinks, then commit the consumed offsets."""
+    started = time.perf_counter()
+    batch = RentalBatch(messages)
+    file_keys = archive_batch(batch)
+    copy_batch_to_postgres(batch)
+    # Only commit once S3 and Postgres both acknowledged the batch
+    consumer.commit()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"✅ Flushed {len(messages)} events | {len(file_keys)} S3 object(s) & Postgres | {elapsed_ms:.0f} ms")
+
+
+def run_batch_loop():
+    buffer = []
+    first_buffered_at = None
+
+    def flush_pending():
+        nonlocal buffer, first_buffered_at
+        if buffer:
+            flush_batch(buffer)
+        buffer = []
+        first_buffered_at = None
+
+    rebalance_listener.on_revoke = flush_pending
+
+    try:
+        while True:
+            polled = consumer.poll(timeout_ms=BATCH_LINGER_MS, max_records=BATCH_SIZE)
+            for messages in polled.values():
+                metrics.observe("fetch", produced_at_ms(messages))
+                buffer.extend(messages)
+
+            if buffer and first_buffered_at is None:
+                first_buffered_at = time.monotonic()
+
+            linger_expired = (
+                first_buffered_at is not None
+                and (time.monotonic() - first_buffered_at) * 1000 >= BATCH_LINGER_MS
+            )
+            if buffer and (len(buffer) >= BATCH_SIZE or linger_expired):
+                flush_pending()
+
+            metrics.maybe_publish(consumer)
+    except KeyboardInterrupt:
+        # Don't drop what is already buffered on shutdown
+        flush_pending()
+        raise
+
 
 # ======================================================
-# 3. STREAMING LOOP
+# 5. PIPELINED SINKS
 # ======================================================
 
-print(f"\n🚀 Hybrid Consumer started!")
-print(f"📡 Listening to topic: '{KAFKA_TOPIC}'...")
-print(f"📊 Targets: Postgres (table: fact_rental_gold) & MinIO (bucket: {BUCKET_NAME})")
-print("-" * 50)
+def offset_and_metadata(offset):
+    # kafka-python >= 2.1 added a leader_epoch field to OffsetAndMetadata
+    return OffsetAndMetadata(*(offset, "", -1)[:len(OffsetAndMetadata._fields)])
+
+
+def print_pipeline_stats(workers, coordinator, fetched, started):
+    elapsed = time.monotonic() - started
+    parts = [f"fetch {fetched / elapsed:.0f} evt/s" if elapsed else "fetch 0 evt/s"]
+    for w in workers:
+        st = w.stats()
+        parts.append(f"{w.sink} q={st['queue_depth']} {st['events_per_s']:.0f} evt/s")
+    parts.append(f"uncommitted batches={coordinator.pending()}")
+    print("📈 " + " | ".join(parts))
+
+
+def run_pipeline_loop():
+    coordinator = CommitCoordinator(["s3", "postgres"])
+    workers = [
+        SinkWorker("s3", archive_batch, coordinator, PIPELINE_QUEUE_SIZE),
+        SinkWorker("postgres", copy_batch_to_postgres, coordinator, PIPELINE_QUEUE_SIZE),
+    ]
+    for w in workers:
+        w.start()
+
+    buffer = []
+    first_buffered_at = None
+    seq = 0
+    fetched = 0
+    started = time.monotonic()
+    last_stats = started
+
+    # sink -> batch of the current dispatch not handed to that sink yet
+    undelivered = {}
+
+    def dispatch(poll=True):
+        nonlocal buffer, first_buffered_at, seq
+        messages = buffer
+        buffer = []
+        first_buffered_at = None
+        offsets = {}
+        for m in messages:
+            tp = TopicPartition(m.topic, m.partition)
+            offsets[tp] = max(m.offset, offsets.get(tp, -1))
+        coordinator.register(seq, offsets)
+        # Decoded once here, shared read-only by both sink threads
+        item = (seq, RentalBatch(messages))
+        seq += 1
+        undelivered.update({w.sink: item for w in workers})
+        received = []
+        for w in workers:
+            received += enqueue(consumer, w, item, undelivered, poll)
+        return received
+
+    def commit_ready():
+        offsets = coordinator.ready_offsets()
+        if offsets:
+            consumer.commit(offsets={tp: offset_and_metadata(o) for tp, o in offsets.items()})
+
+    def drain():
+        # Called from poll() on rebalance: everything fetched so far must be
+        # written by both sinks and committed before partitions move.
+        # No polling in here: finish a dispatch interrupted by this rebalance
+        for w in workers:
+            if w.sink in undelivered:
+                enqueue(consumer, w, undelivered[w.sink], undelivered, poll=False)
+        if buffer:
+            dispatch(poll=False)
+        # Wait until both sinks acked the last registered batch (seq - 1)
+        while coordinator.frontier() < seq - 1:
+            for w in workers:
+                if w.error is not None:
+                    raise RuntimeError(f"{w.sink} sink failed: {w.error}")
+            time.sleep(0.05)
+        commit_ready()
+
+    rebalance_listener.on_revoke = drain
+
+    try:
+        while True:
+            for w in workers:
+                if w.error is not None:
+                    raise RuntimeError(f"{w.sink} sink failed: {w.error}")
+
+            polled = consumer.poll(timeout_ms=min(BATCH_LINGER_MS, 500), max_records=BATCH_SIZE)
+            for messages in polled.values():
+                metrics.observe("fetch", produced_at_ms(messages))
+                buffer.extend(messages)
+                fetched += len(messages)
 
-try:
+            if buffer and first_buffered_at is None:
+                first_buffered_at = time.monotonic()
+
+            linger_expired = (
+                first_buffered_at is not None
+                and (time.monotonic() - first_buffered_at) * 1000 >= BATCH_LINGER_MS
+            )
+            if buffer and (len(buffer) >= BATCH_SIZE or linger_expired):
+                # Records polled while waiting on a full queue start the next batch
+                buffer.extend(dispatch())
+                if buffer:
+                    first_buffered_at = time.monotonic()
+
+            # Commits must happen on the consumer's own thread
+            commit_ready()
+            metrics.maybe_publish(consumer)
+
+            if time.monotonic() - last_stats >= PIPELINE_STATS_INTERVAL:
+                print_pipeline_stats(workers, coordinator, fetched, started)
+                last_stats = time.monotonic()
+    finally:
+        # Drain: hand over what is buffered, stop the writers, commit the rest
+        if buffer and all(w.error is None for w in workers):
+            dispatch(poll=False)
+        for w in workers:
+            if w.is_alive():
+                w.queue.put(None)
+        for w in workers:
+            w.join()
+        commit_ready()
+        print_pipeline_stats(workers, coordinator, fetched, started)
+
+
+def run_message_loop():
     for message in consumer:
         data = message.value
-        
+        metrics.observe("fetch", produced_at_ms([message]))
+    
         # --- STEP 1: Archive to MinIO (Bronze) ---
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         file_key = f"streamed_data/rental_{timestamp}.json"
-        
+    
         s3_client.put_object(
             Bucket=BUCKET_NAME,
             Key=file_key,
             Body=json.dumps(data, indent=4)
         )
-        
+        metrics.observe("s3_ack", produced_at_ms([message]))
+    
         # --- STEP 2: Direct Insert to Postgres (Gold) ---
         # Convert the single dictionary message to a DataFrame
-        df_new = pd.DataFrame([data])
-        
-        # Use 'append' to add new rows without deleting historical data
-        df_new.to_sql('fact_rental_gold', pg_engine, if_exists='append', index=False)
-        
+        df_new = pd.DataFrame([data]).drop(columns=META_FIELDS, errors="ignore")
+        df_new = add_date_key(df_new)
+    
+        # Same idempotent upsert as the batch modes, which also updates the KPI summaries
+        upsert_to_postgres(df_new)
+        metrics.observe("pg_commit", produced_at_ms([message]))
+        metrics.maybe_publish(consumer)
+    
         # Success Log
         movie_title = data.get('title', 'Unknown Movie')
         amount = data.get('amount', 0.0)
         print(f"✅ Processed Sale: {movie_title} ({amount}€) | Saved to S3 & Postgres")
 
-except KeyboardInterrupt:
-    print("\n🛑 Stopping Consumer...")
\ No newline at end of file
+
+# ======================================================
+# 6. STREAMING LOOP
+# ======================================================
+
+def run_worker(worker_id=0):
+    global consumer
+    consumer = create_consumer()
+    ensure_metrics_table()
+    start_metrics_server(worker_id)
+
+    print(f"\n🚀 Hybrid Consumer started! (worker {worker_id})")
+    print(f"📡 Listening to topic: '{KAFKA_TOPIC}'...")
+    print(f"📊 Targets: Postgres (table: fact_rental_gold) & MinIO (bucket: {BUCKET_NAME})")
+    if CONSUMER_MODE in ("batch", "pipeline"):
+        print(f"📦 Micro-batch mode: {BATCH_SIZE} events / {BATCH_LINGER_MS} ms linger, archive as {ARCHIVE_FORMAT}")
+        print(f"👥 Consumer group: {KAFKA_GROUP_ID}")
+    print("-" * 50)
+
+    try:
+        if CONSUMER_MODE == "batch":
+            run_batch_loop()
+        elif CONSUMER_MODE == "pipeline":
+            run_pipeline_loop()
+        else:
+            run_message_loop()
+
+    except KeyboardInterrupt:
+        print(f"\n🛑 Stopping Consumer (worker {worker_id})...")
+    finally:
+        consumer.close(autocommit=False)
+
+
+if __name__ == "__main__":
+    if CONSUMER_WORKERS > 1 and CONSUMER_MODE in ("batch", "pipeline"):
+        # One consumer per process; the group coordinator splits partitions
+        ctx = multiprocessing.get_context("spawn")
+        processes = [ctx.Process(target=run_worker, args=(i,)) for i in range(CONSUMER_WORKERS)]
+        for p in processes:
+            p.start()
+        try:
+            for p in processes:
+                p.join()
+        except KeyboardInterrupt:
+            for p in processes:
+                p.join()
+    else:
+        run_worker()
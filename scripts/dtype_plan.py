@@ -0,0 +1,220 @@
+"""
+dtype_plan.py
+-------------
+Declared compact dtypes for the Silver and Gold tables.
+
+Default pandas dtypes are wide: int64 ids, object strings, float64 money.
+COLUMN_DTYPES gives every known column a compact type instead:
+- integers downcast to the width of their Postgres source column
+  (int4 -> int32, int2 -> int16), nullable ("Int16") where joins can miss
+- low-cardinality strings as dictionary-encoded categories
+- money as fixed-point decimals (Arrow decimal128, exact in Parquet)
+- special_features as a native list<string> column
+
+The plan is applied at write time and again after reading a Parquet file
+(apply_dtype_plan is idempotent), so the types survive merges and reads.
+Parquet goes through write_parquet / read_parquet: the pandas schema
+metadata is not stored (pandas can't parse back the names of Arrow-backed
+dtypes such as list<item: string>[pyarrow]) and the plan restores the
+dtypes on read instead. Category columns are written with int32
+dictionary indices so chunks with more categories than the first fit.
+Columns with a merge suffix (e.g. "rental_rate_film") follow their base
+column; columns not in the plan are left untouched.
+
+Usage:
+    from dtype_plan import MemoryReport, apply_dtype_plan, read_parquet, write_parquet
+    report = MemoryReport()
+    df = apply_dtype_plan(df, "dim_film", report)
+    write_parquet(df, "s3://silver/dim_film.parquet", filesystem=fs)
+    df = read_parquet("s3://silver/dim_film.parquet", filesystem=fs)
+    report.print_report()
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+MERGE_SUFFIXES = ("_film",)
+
+COLUMN_DTYPES = {
+    # -------- ids / integers --------
+    "rental_id": "int32",
+    "inventory_id": "int32",
+    "customer_id": "int32",
+    "staff_id": "int16",
+    "film_id": "Int32",
+    "store_id": "Int16",
+    "release_year": "Int16",
+    "rental_duration": "Int16",
+    "length": "Int16",
+    "actual_rental_duration": "Int16",
+    # -------- low-cardinality strings --------
+    "title": "category",
+    "category": "category",
+    "rating": "category",
+    # -------- money (numeric(4,2) / numeric(5,2) in dvdrental) --------
+    "rental_rate": ("decimal", 4, 2),
+    "replacement_cost": ("decimal", 5, 2),
+    # -------- ratios --------
+    "rental_yield": "float32",
+    # -------- lists --------
+    "special_features": "list<string>",
+    # -------- Gold time dimension --------
+    "date_key": "Int32",
+    "year": "int16",
+    "quarter": "int8",
+    "month": "int8",
+    "day": "int8",
+    "week": "int8",
+    "day_of_week": "category",
+    "is_weekend": "bool",
+}
+
+
+# ======================================================
+# Conversions
+# ======================================================
+
+def _to_integer(s: pd.Series, dtype: str) -> pd.Series:
+    """Cast to a narrower integer type, refusing values that would wrap."""
+    if s.dtype == dtype:
+        return s
+    info = np.iinfo(dtype.lower())
+    values = pd.to_numeric(s)
+    if len(values.dropna()) and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(
+            f"❌ Column '{s.name}' ({values.min()}..{values.max()}) does not fit in {dtype}"
+        )
+    return values.astype(dtype)
+
+
+def _to_decimal(s: pd.Series, precision: int, scale: int) -> pd.Series:
+    target = pd.ArrowDtype(pa.decimal128(precision, scale))
+    if s.dtype == target:
+        return s
+    if pd.api.types.is_float_dtype(s):
+        s = s.round(scale)
+    values = pa.array(s, from_pandas=True).cast(pa.decimal128(precision, scale))
+    return pd.Series(pd.arrays.ArrowExtensionArray(values), index=s.index, name=s.name)
+
+
+def _parse_list(value):
+    if value is None or (np.isscalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, str):
+        # Postgres array literal: {Trailers,"Deleted Scenes"}
+        inner = value.strip().strip("{}")
+        return [v.strip().strip('"') for v in inner.split(",")] if inner else []
+    return list(value)
+
+
+def _to_string_list(s: pd.Series) -> pd.Series:
+    target = pd.ArrowDtype(pa.list_(pa.string()))
+    if s.dtype == target:
+        return s
+    values = pa.array([_parse_list(v) for v in s], type=pa.list_(pa.string()))
+    return pd.Series(pd.arrays.ArrowExtensionArray(values), index=s.index, name=s.name)
+
+
+def _convert(s: pd.Series, spec) -> pd.Series:
+    if isinstance(spec, tuple):
+        return _to_decimal(s, *spec[1:])
+    if spec == "list<string>":
+        return _to_string_list(s)
+    if spec == "category":
+        return s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype("category")
+    if spec.lower().startswith(("int", "uint")):
+        return _to_integer(s, spec)
+    return s.astype(spec)
+
+
+def planned_dtype(column: str):
+    """Plan entry for a column (merge suffixes stripped), or None."""
+    if column in COLUMN_DTYPES:
+        return COLUMN_DTYPES[column]
+    for suffix in MERGE_SUFFIXES:
+        if column.endswith(suffix):
+            return COLUMN_DTYPES.get(column[:-len(suffix)])
+    return None
+
+
+def apply_dtype_plan(df: pd.DataFrame, table_name: str = None, report=None) -> pd.DataFrame:
+    """Return `df` with every planned column cast to its compact dtype."""
+    before = df.memory_usage(deep=True).sum() if report is not None else 0
+
+    converted = {}
+    for column in df.columns:
+        spec = planned_dtype(column)
+        if spec is not None:
+            converted[column] = _convert(df[column], spec)
+    if converted:
+        df = df.assign(**converted)
+
+    if report is not None:
+        report.add(table_name, before, df.memory_usage(deep=True).sum())
+    return df
+
+
+# ======================================================
+# Parquet I/O
+# ======================================================
+
+def parquet_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Schema used to write planned frames: dictionary (category) indices
+    widened to int32, whatever the first chunk needed, and no pandas metadata.
+    """
+    fields = [
+        pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type), f.nullable)
+        if pa.types.is_dictionary(f.type) else f
+        for f in schema
+    ]
+    return pa.schema(fields)
+
+
+def to_arrow(df: pd.DataFrame, schema: pa.Schema = None) -> pa.Table:
+    """Arrow table of a planned frame, with `schema` or the parquet_schema of its own."""
+    if schema is None:
+        schema = parquet_schema(pa.Schema.from_pandas(df, preserve_index=False))
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False).replace_schema_metadata(None)
+
+
+def _fs_path(path: str, filesystem) -> str:
+    # pyarrow wants bare paths ("bucket/key") with an fsspec filesystem
+    return path.split("://", 1)[1] if filesystem is not None and "://" in path else path
+
+
+def write_parquet(df: pd.DataFrame, path: str, filesystem=None):
+    pq.write_table(to_arrow(df), _fs_path(path, filesystem), filesystem=filesystem)
+
+
+def read_parquet(path: str, filesystem=None, columns=None, exclude=()) -> pd.DataFrame:
+    """
+    Read a Parquet file or dataset, ignoring stored pandas metadata, then
+    apply the plan. `exclude` drops columns first (e.g. a hive partition key).
+    """
+    table = pq.read_table(_fs_path(path, filesystem).rstrip("/"), filesystem=filesystem, columns=columns)
+    table = table.drop([c for c in exclude if c in table.column_names])
+    return apply_dtype_plan(table.to_pandas(ignore_metadata=True))
+
+
+# ======================================================
+# Memory report
+# ======================================================
+
+class MemoryReport:
+    """Accumulates in-memory size per table before / after the plan."""
+
+    def __init__(self):
+        self.tables = {}
+
+    def add(self, table_name, before_bytes, after_bytes):
+        before, after = self.tables.get(table_name, (0, 0))
+        self.tables[table_name] = (before + int(before_bytes), after + int(after_bytes))
+
+    def print_report(self):
+        print("\n📦 Memory per table (default dtypes → dtype plan)")
+        for table_name, (before, after) in self.tables.items():
+            saved = (1 - after / before) * 100 if before else 0
+            print(f"   {table_name:<20} {before / 1e6:>9.2f} MB → {after / 1e6:>9.2f} MB  (-{saved:.0f}%)")
@@ -0,0 +1,250 @@
+"""
+kpi_state.py
+------------
+Mergeable partial aggregates for the Gold KPIs.
+
+Instead of storing finished (rounded) means, each KPI table stores a
+partial state per group: for every measure its non-null count, sum, sum
+of squares, min and max, plus the number of rentals. Two states of the
+same group merge by adding counts/sums and taking min/max, so new rows
+are folded in without rescanning history. Means and variances are only
+computed when reading (finalize_state, or the v_kpi_* SQL views).
+
+Updated rentals are handled as a retraction of the old version
+(sign = -1) plus the new version (sign = +1): counts, sums and sums of
+squares stay exact, min/max are only ever widened.
+
+States exist per category, per day, per title, per customer and one
+global row (KPI_GROUPS). The batch Gold build (save_gold.py) keeps them
+as Parquet; the Kafka consumer keeps the Postgres copies live: each batch
+is turned into one signed delta (delta_sql()) that fold_sql() upserts into
+every state table, so dashboards read O(groups) rows instead of the fact.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Measure column -> label used in the finalized KPI names (avg_<label>, ...)
+MEASURES = {
+    "rental_rate": "rental_rate",
+    "length": "film_length",
+    "replacement_cost": "replacement_cost",
+    "actual_rental_duration": "rental_duration",
+}
+
+# KPI name -> group key columns
+KPI_GROUPS = {
+    "category": ("category",),
+    "daily": ("date_key",),
+    "title": ("title", "category"),
+    "customer": ("customer_id",),
+    "global": ("kpi_id",),
+}
+
+# Postgres tables holding the states (loaded from Gold, folded by the consumer)
+STATE_TABLES = {
+    "category": "gold_kpi_category_state",
+    "daily": "gold_kpi_daily_state",
+    "title": "gold_kpi_title_state",
+    "customer": "gold_kpi_customer_state",
+    "global": "gold_kpi_global_state",
+}
+
+# Null labels are kept as their own group (a NULL key can't be upserted);
+# rows with another null key (date, customer) are left out of that KPI
+UNKNOWN_KEY = "Unknown"
+LABEL_KEYS = ("category", "title")
+# The global KPI is a single row keyed by a constant
+GLOBAL_KEY = "kpi_id"
+SIGN_COLUMN = "_sign"
+# Per-batch signed delta (temp table) folded into every state table
+DELTA_TABLE = "_kpi_delta"
+
+
+def state_columns():
+    columns = ["n_rentals"]
+    for m in MEASURES:
+        columns += [f"{m}_count", f"{m}_sum", f"{m}_sumsq", f"{m}_min", f"{m}_max"]
+    return columns
+
+
+def fact_columns():
+    """Fact columns a delta needs: every group key plus the measures."""
+    keys = {key for group in KPI_GROUPS.values() for key in group if key != GLOBAL_KEY}
+    return sorted(keys) + list(MEASURES)
+
+
+def _prepare_keys(df: pd.DataFrame, keys) -> pd.DataFrame:
+    for key in keys:
+        if key == GLOBAL_KEY:
+            df = df.assign(**{GLOBAL_KEY: 1})
+        elif key in LABEL_KEYS:
+            df = df.assign(**{key: df[key].astype("object").fillna(UNKNOWN_KEY)})
+        else:
+            df = df[df[key].notna()]
+    return df
+
+
+# ======================================================
+# Build / merge
+# ======================================================
+
+def partial_state(df: pd.DataFrame, kpi: str) -> pd.DataFrame:
+    """
+    Partial state of `df` grouped by the KPI key. Rows may carry a `_sign`
+    column (+1 insert, -1 retraction); missing measures count as null.
+    """
+    keys = KPI_GROUPS[kpi]
+    df = _prepare_keys(df, keys)
+    sign = df[SIGN_COLUMN] if SIGN_COLUMN in df.columns else pd.Series(1, index=df.index)
+
+    parts = {key: df[key].to_numpy() for key in keys}
+    parts["n_rentals"] = sign.to_numpy()
+    for m in MEASURES:
+        x = df[m].astype("float64") if m in df.columns else pd.Series(np.nan, index=df.index)
+        present = x.notna()
+        inserted = x.where(sign > 0)
+        parts[f"{m}_count"] = (sign * present).to_numpy()
+        parts[f"{m}_sum"] = (sign * x.fillna(0)).to_numpy()
+        parts[f"{m}_sumsq"] = (sign * x.fillna(0) ** 2).to_numpy()
+        parts[f"{m}_min"] = inserted.to_numpy()
+        parts[f"{m}_max"] = inserted.to_numpy()
+
+    return _combine(pd.DataFrame(parts), keys)
+
+
+def _combine(rows: pd.DataFrame, keys) -> pd.DataFrame:
+    agg = {}
+    for column in state_columns():
+        if column.endswith("_min"):
+            agg[column] = "min"
+        elif column.endswith("_max"):
+            agg[column] = "max"
+        else:
+            agg[column] = "sum"
+    state = rows.groupby(list(keys), sort=True).agg(agg).reset_index()
+    count_columns = ["n_rentals"] + [f"{m}_count" for m in MEASURES]
+    state[count_columns] = state[count_columns].astype("int64")
+    return state
+
+
+def merge_states(*states: pd.DataFrame, kpi: str) -> pd.DataFrame:
+    """Fold several partial states of the same KPI into one."""
+    states = [s for s in states if s is not None and len(s)]
+    keys = KPI_GROUPS[kpi]
+    if not states:
+        return pd.DataFrame(columns=list(keys) + state_columns())
+    return _combine(pd.concat(states, ignore_index=True), keys)
+
+
+# ======================================================
+# Read time
+# ======================================================
+
+def finalize_state(state: pd.DataFrame, kpi: str) -> pd.DataFrame:
+    """Means, sample variances, min and max from a partial state."""
+    out = state[list(KPI_GROUPS[kpi])].copy()
+    out["total_rentals"] = state["n_rentals"]
+    for m, label in MEASURES.items():
+        n = state[f"{m}_count"].astype("float64")
+        s = state[f"{m}_sum"]
+        mean = s / n.where(n > 0)
+        out[f"avg_{label}"] = mean
+        out[f"var_{label}"] = ((state[f"{m}_sumsq"] - s * mean) / (n - 1).where(n > 1)).clip(lower=0)
+        out[f"min_{label}"] = state[f"{m}_min"]
+        out[f"max_{label}"] = state[f"{m}_max"]
+    return out.round(2)
+
+
+# ======================================================
+# Postgres folding (streaming)
+# ======================================================
+
+def lock_keys_sql(stage_table: str, fact_table: str) -> str:
+    """
+    Transaction-level advisory lock on every rental_id of a staged batch,
+    taken in key order. Must run before delta_sql(): two consumers upserting
+    the same rental_id would otherwise both retract the same old version
+    and both add the new one. Unlike SELECT ... FOR UPDATE it also covers
+    keys not inserted yet.
+    """
+    return f"""
+        SELECT pg_advisory_xact_lock('{fact_table}'::regclass::oid::int, rental_id::int)
+        FROM (SELECT DISTINCT rental_id FROM {stage_table} ORDER BY rental_id) AS k
+    """
+
+
+def delta_sql(stage_table: str, fact_table: str, columns) -> str:
+    """
+    Signed delta of a staged batch, as a temp table dropped at commit: the
+    new version of each row (+1) and its current version in `fact_table`
+    (-1). Must run before the batch is upserted into `fact_table`, so a
+    replayed batch nets out to nothing.
+
+    `columns` are the columns the upsert writes; the others keep their
+    current value in `fact_table`, and the new version is built the same way.
+    """
+    needed = fact_columns()
+    new_cols = ", ".join(f"{'s' if c in columns else 'f'}.{c} AS {c}" for c in needed)
+    old_cols = ", ".join(f"f.{c}" for c in needed)
+    return f"""
+        CREATE TEMP TABLE {DELTA_TABLE} ON COMMIT DROP AS
+        SELECT 1 AS sign, {new_cols}
+        FROM {stage_table} s LEFT JOIN {fact_table} f USING (rental_id)
+        UNION ALL
+        SELECT -1 AS sign, {old_cols}
+        FROM {fact_table} f JOIN {stage_table} s USING (rental_id)
+    """
+
+
+def fold_sql(kpi: str, delta_table: str = DELTA_TABLE) -> str:
+    """
+    INSERT ... ON CONFLICT statement folding the batch delta into one KPI
+    state table. Groups are written in key order, so concurrent consumers
+    lock the shared state rows in the same order instead of deadlocking.
+    """
+    keys = KPI_GROUPS[kpi]
+    table = STATE_TABLES[kpi]
+    measures = list(MEASURES)
+
+    key_exprs = []
+    not_null = []
+    for key in keys:
+        if key == GLOBAL_KEY:
+            key_exprs.append(f"1 AS {key}")
+        elif key in LABEL_KEYS:
+            key_exprs.append(f"COALESCE({key}::text, '{UNKNOWN_KEY}') AS {key}")
+        else:
+            key_exprs.append(key)
+            not_null.append(f"{key} IS NOT NULL")
+    where = f"WHERE {' AND '.join(not_null)}" if not_null else ""
+    group_by = ", ".join(str(i + 1) for i in range(len(keys)))
+
+    select = ["SUM(sign) AS n_rentals"]
+    for m in measures:
+        select += [
+            f"COALESCE(SUM(sign) FILTER (WHERE {m} IS NOT NULL), 0) AS {m}_count",
+            f"COALESCE(SUM(sign * {m}), 0) AS {m}_sum",
+            f"COALESCE(SUM(sign * {m} * {m}), 0) AS {m}_sumsq",
+            f"MIN({m}) FILTER (WHERE sign > 0) AS {m}_min",
+            f"MAX({m}) FILTER (WHERE sign > 0) AS {m}_max",
+        ]
+
+    updates = []
+    for column in state_columns():
+        if column.endswith("_min"):
+            updates.append(f"{column} = LEAST(t.{column}, EXCLUDED.{column})")
+        elif column.endswith("_max"):
+            updates.append(f"{column} = GREATEST(t.{column}, EXCLUDED.{column})")
+        else:
+            updates.append(f"{column} = t.{column} + EXCLUDED.{column}")
+
+    return f"""
+        INSERT INTO {table} AS t ({", ".join(keys)}, {", ".join(state_columns())})
+        SELECT {", ".join(key_exprs)}, {", ".join(select)}
+        FROM {delta_table}
+        {where}
+        GROUP BY {group_by}
+        ORDER BY {group_by}
+        ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {", ".join(updates)}
+    """
@@ -1,8 +1,13 @@
-import pandas as pd
+import os
+import re
+import time
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pyarrow as pa
+import pyarrow.parquet as pq
 import s3fs
-import json
-import numpy as np
 from sqlalchemy import create_engine
+from pg_copy_writer import pg_type, to_copy_csv
 
 # ======================================================
 # 1. CONFIGURATION
@@ -23,26 +28,163 @@ PG_SCHEMA = "public"
 
 # -------- Tables GOLD --------
 GOLD_TABLES = {
-    "fact_rental_gold": "s3://gold/fact_rental_gold.parquet",
+    # Dataset partitionné par mois (fact_rental_gold/month=YYYY-MM/), lu fichier par fichier
+    "fact_rental_gold": "s3://gold/fact_rental_gold/",
     "dim_time": "s3://gold/dim_time.parquet",
-    "gold_kpi_category": "s3://gold/gold_kpi_category.parquet"
+    "gold_kpi_category": "s3://gold/gold_kpi_category.parquet",
+    "gold_kpi_daily": "s3://gold/gold_kpi_daily.parquet",
+    # États partiels des KPI (count, sum, sumsq, min, max), enrichis ensuite par le consumer Kafka
+    "gold_kpi_category_state": "s3://gold/gold_kpi_category_state.parquet",
+    "gold_kpi_daily_state": "s3://gold/gold_kpi_daily_state.parquet",
+    "gold_kpi_title_state": "s3://gold/gold_kpi_title_state.parquet",
+    "gold_kpi_customer_state": "s3://gold/gold_kpi_customer_state.parquet",
+    "gold_kpi_global_state": "s3://gold/gold_kpi_global_state.parquet"
 }
 
+# -------- Index construits sur la table de staging, avant le swap --------
+# (nom final, DDL) ; {name} / {table} sont remplis au moment du chargement
+# date_key : jointure entière fact_rental_gold -> dim_time (mv_revenue_monthly)
+TABLE_INDEXES = {
+    "fact_rental_gold": [
+        # Clé de l'upsert ON CONFLICT (rental_id) du consumer Kafka
+        ("ux_fact_rental_gold_rental_id", "CREATE UNIQUE INDEX {name} ON {table} (rental_id)"),
+        ("idx_fact_rental_gold_date_key", "CREATE INDEX {name} ON {table} (date_key)"),
+        # Lecture incrémentale du dashboard (lignes insérées depuis le dernier refresh)
+        ("idx_fact_rental_gold_ingested_at", "CREATE INDEX {name} ON {table} (ingested_at)"),
+    ],
+    "dim_time": [
+        ("idx_dim_time_date_key", "CREATE UNIQUE INDEX {name} ON {table} (date_key)"),
+    ],
+    # Clés des INSERT ... ON CONFLICT du consumer
+    "gold_kpi_category_state": [
+        ("ux_gold_kpi_category_state", "CREATE UNIQUE INDEX {name} ON {table} (category)"),
+    ],
+    "gold_kpi_daily_state": [
+        ("ux_gold_kpi_daily_state", "CREATE UNIQUE INDEX {name} ON {table} (date_key)"),
+    ],
+    "gold_kpi_title_state": [
+        ("ux_gold_kpi_title_state", "CREATE UNIQUE INDEX {name} ON {table} (title, category)"),
+    ],
+    "gold_kpi_customer_state": [
+        ("ux_gold_kpi_customer_state", "CREATE UNIQUE INDEX {name} ON {table} (customer_id)"),
+    ],
+    "gold_kpi_global_state": [
+        ("ux_gold_kpi_global_state", "CREATE UNIQUE INDEX {name} ON {table} (kpi_id)"),
+    ],
+}
+
+# -------- Colonnes absentes du Parquet, ajoutées à la staging : (nom, type, défaut) --------
+# ingested_at : NULL pour l'historique Gold, now() pour les lignes insérées ensuite
+# par le consumer Kafka ; le cache incrémental du dashboard lit les lignes récentes
+TABLE_EXTRA_COLUMNS = {
+    "fact_rental_gold": [("ingested_at", "timestamptz", "now()")],
+}
+
+# -------- Chargement --------
+STAGING_SUFFIX = "__staging"
+COPY_BATCH_ROWS = 100_000        # lignes Parquet lues puis envoyées par COPY
+SWAP_LOCK_TIMEOUT = "10s"        # n'attend pas indéfiniment les lectures en cours
+
+# parallel = une connexion par table, tables chargées en même temps
+# serial   = une table après l'autre (le row group suivant reste préchargé)
+LOAD_MODE = os.getenv("LOAD_MODE", "parallel")
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", "4"))
+# Lectures de row groups MinIO : chaque table lit le suivant pendant le COPY en cours
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+
 # ======================================================
 # 2. UTILS
 # ======================================================
 
-def convert_array_columns_to_json(df: pd.DataFrame) -> pd.DataFrame:
+def qualified(name: str) -> str:
+    return f'{PG_SCHEMA}."{name}"'
+
+
+def staging_ddl(schema: pa.Schema, table: str) -> str:
+    columns = ",\n    ".join(f'"{f.name}" {pg_type(f.type)}' for f in schema)
+    return f"CREATE TABLE {qualified(table)} (\n    {columns}\n)"
+
+
+def copy_batch(cursor, batch: pa.RecordBatch, table: str) -> int:
+    """Envoie un lot Arrow dans `table` via COPY FROM STDIN (CSV écrit par Arrow)."""
+    buffer = to_copy_csv(batch)
+    columns = ", ".join(f'"{c}"' for c in batch.schema.names)
+    cursor.copy_expert(f"COPY {qualified(table)} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return batch.num_rows
+
+
+# Vues (et vues matérialisées) qui dépendent d'une relation : elles suivent
+# l'ancienne table lors d'un rename, il faut donc les reconstruire sur les stagings
+DEPENDENT_VIEWS_SQL = """
+    SELECT DISTINCT v.oid, n.nspname, v.relname, v.relkind, pg_get_viewdef(v.oid, true)
+    FROM pg_depend d
+    JOIN pg_rewrite r ON r.oid = d.objid
+    JOIN pg_class v ON v.oid = r.ev_class
+    JOIN pg_namespace n ON n.oid = v.relnamespace
+    WHERE d.refobjid = %s AND v.oid <> %s
+"""
+
+
+def capture_dependent_views(cursor, oid, seen=None):
+    """Définitions (et index) des vues dépendant de `oid`, parents d'abord."""
+    seen = set() if seen is None else seen
+    cursor.execute(DEPENDENT_VIEWS_SQL, (oid, oid))
+    views = []
+    for view_oid, schema, name, kind, definition in cursor.fetchall():
+        if view_oid in seen:
+            continue
+        seen.add(view_oid)
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = %s AND tablename = %s",
+            (schema, name)
+        )
+        indexes = cursor.fetchall()
+        views.append((view_oid, schema, name, kind, definition, indexes))
+        views += capture_dependent_views(cursor, view_oid, seen)
+    return views
+
+
+def capture_views(cursor, table_names):
+    """
+    Vues dépendant de n'importe quelle table publiée, capturées une seule fois.
+    Triées par oid : une vue est créée après celles qu'elle lit.
+    """
+    views, seen = [], set()
+    for table_name in table_names:
+        cursor.execute("SELECT to_regclass(%s)::oid", (qualified(table_name),))
+        live_oid = cursor.fetchone()[0]
+        if live_oid is not None:
+            views += capture_dependent_views(cursor, live_oid, seen)
+    return [view[1:] for view in sorted(views)]
+
+
+def view_type(kind: str) -> str:
+    return "MATERIALIZED VIEW" if kind == "m" else "VIEW"
+
+
+def build_views(cursor, views, table_names):
     """
-    Convertit toutes les colonnes contenant des listes ou numpy arrays
-    en JSON string pour compatibilité PostgreSQL.
+    Reconstruit chaque vue dépendante sous <nom>__staging, sur les tables de
+    staging, avant le swap : les vues matérialisées sont remplies ici, hors
+    de la transaction de publication, qui n'a plus qu'à les renommer.
+    Les noms des tables, vues et index sont remplacés dans les définitions.
     """
-    for col in df.columns:
-        if df[col].apply(lambda x: isinstance(x, (list, np.ndarray))).any():
-            df[col] = df[col].apply(
-                lambda x: json.dumps(list(x)) if isinstance(x, (list, np.ndarray)) else x
-            )
-    return df
+    names = list(table_names)
+    for _, name, _, _, indexes in views:
+        names.append(name)
+        names += [index_name for index_name, _ in indexes]
+    pattern = re.compile(r"\b(" + "|".join(re.escape(n) for n in sorted(names, key=len, reverse=True)) + r")\b")
+
+    def to_staging(sql):
+        return pattern.sub(lambda m: m.group(1) + STAGING_SUFFIX, sql)
+
+    for schema, name, kind, definition, indexes in views:
+        staged = f'{schema}."{name}{STAGING_SUFFIX}"'
+        # Reste d'un chargement interrompu
+        cursor.execute(f"DROP {view_type(kind)} IF EXISTS {staged} CASCADE")
+        cursor.execute(f"CREATE {view_type(kind)} {staged} AS {to_staging(definition.rstrip().rstrip(';'))}")
+        for _, indexdef in indexes:
+            cursor.execute(to_staging(indexdef))
 
 
 # ======================================================
@@ -57,34 +199,199 @@ fs = s3fs.S3FileSystem(
 )
 
 print("🔌 Connexion à PostgreSQL...")
+load_workers = LOAD_WORKERS if LOAD_MODE == "parallel" else 1
 engine = create_engine(
-    f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
+    f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}",
+    # Une connexion par table chargée en parallèle + celle de la publication
+    pool_size=load_workers + 1,
+    max_overflow=0
 )
 
 # ======================================================
-# 4. LOAD GOLD → POSTGRES
+# 4. LOAD GOLD → POSTGRES (prefetch + COPY en staging + publication)
 # ======================================================
 
-for table_name, s3_path in GOLD_TABLES.items():
-    print(f"\n📥 Lecture de {table_name} depuis MinIO...")
-    
-    df = pd.read_parquet(s3_path, filesystem=fs)
-    print(f"   ➜ {len(df)} lignes chargées")
-
-    print("🧹 Conversion des colonnes ARRAY → JSON...")
-    df = convert_array_columns_to_json(df)
-
-    print(f"📤 Chargement de {table_name} dans PostgreSQL...")
-    df.to_sql(
-        table_name,
-        engine,
-        schema=PG_SCHEMA,
-        if_exists="replace",   # replace = warehouse refresh
-        index=False,
-        method="multi",
-        chunksize=1000
-    )
-
-    print(f"✅ {table_name} chargé avec succès")
+def read_row_group(parquet, index):
+    """Lit un row group depuis MinIO. Retourne (table, secondes)."""
+    started = time.perf_counter()
+    table = parquet.read_row_group(index)
+    return table, time.perf_counter() - started
+
+
+def load_staging(cursor, staging, parquets, downloader) -> tuple:
+    """
+    Crée la table de staging depuis le schéma Parquet et la remplit par COPY,
+    row group par row group (fichier après fichier pour un dataset partitionné) :
+    le suivant est lu pendant le COPY du courant, jamais le fichier entier en
+    mémoire. Retourne (lignes, secondes de lecture).
+    """
+    # CASCADE : vues __staging laissées par un chargement interrompu
+    cursor.execute(f"DROP TABLE IF EXISTS {qualified(staging)} CASCADE")
+    cursor.execute(staging_ddl(parquets[0].schema_arrow, staging))
+
+    rows, read_s = 0, 0.0
+    groups = [(parquet, index) for parquet in parquets for index in range(parquet.num_row_groups)]
+    pending = downloader.submit(read_row_group, *groups[0]) if groups else None
+    for i in range(len(groups)):
+        table, seconds = pending.result()
+        read_s += seconds
+        if i + 1 < len(groups):
+            pending = downloader.submit(read_row_group, *groups[i + 1])
+        for batch in table.to_batches(max_chunksize=COPY_BATCH_ROWS):
+            rows += copy_batch(cursor, batch, staging)
+    return rows, read_s
+
+
+def add_extra_columns(cursor, table_name, staging):
+    """Ajoutées sans défaut (l'historique reste NULL), puis le défaut est posé pour les inserts."""
+    for name, column_type, default in TABLE_EXTRA_COLUMNS.get(table_name, []):
+        cursor.execute(f'ALTER TABLE {qualified(staging)} ADD COLUMN IF NOT EXISTS "{name}" {column_type}')
+        cursor.execute(f'ALTER TABLE {qualified(staging)} ALTER COLUMN "{name}" SET DEFAULT {default}')
+
+
+def build_indexes(cursor, table_name, staging):
+    """Index construits une fois les données en place (plus rapide que ligne à ligne)."""
+    for name, ddl in TABLE_INDEXES.get(table_name, []):
+        cursor.execute(ddl.format(name=f'"{name}{STAGING_SUFFIX}"', table=qualified(staging)))
+    cursor.execute(f"ANALYZE {qualified(staging)}")
+
+
+def stage_table(table_name, s3_path, downloader) -> dict:
+    """
+    Charge une table dans sa staging, sur sa propre connexion, en lisant le
+    Parquet MinIO en flux. La table live n'est pas touchée.
+    """
+    staging = f"{table_name}{STAGING_SUFFIX}"
+    started = time.perf_counter()
+    # Un fichier, ou tous les fichiers Parquet d'un dataset partitionné
+    paths = sorted(p for p in fs.find(s3_path) if p.endswith(".parquet")) if s3_path.endswith("/") else [s3_path]
+    if not paths:
+        raise FileNotFoundError(f"Aucun fichier Parquet sous {s3_path}")
+    conn = engine.raw_connection()
+    try:
+        with ExitStack() as stack, conn.cursor() as cursor:
+            files = [stack.enter_context(fs.open(path, "rb")) for path in paths]
+            n_bytes = sum(f.size for f in files)
+            rows, download_s = load_staging(cursor, staging, [pq.ParquetFile(f) for f in files], downloader)
+            copy_s = time.perf_counter() - started
+            add_extra_columns(cursor, table_name, staging)
+            build_indexes(cursor, table_name, staging)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return {
+        "table": table_name,
+        "rows": rows,
+        "bytes": n_bytes,
+        "download_s": download_s,
+        "copy_s": copy_s,
+        "index_s": time.perf_counter() - started - copy_s,
+    }
+
+
+def stage_views(table_names):
+    """Capture les vues dépendantes et les reconstruit (remplies) sur les stagings."""
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            views = capture_views(cursor, table_names)
+            build_views(cursor, views, table_names)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return views
+
+
+def publish_tables(cursor, table_names, views):
+    """
+    Remplace toutes les tables live (et leurs vues) par leurs stagings dans
+    UNE transaction de renommages : les lecteurs voient l'ancien entrepôt
+    complet jusqu'au COMMIT, puis le nouveau, vues matérialisées remplies.
+    """
+    cursor.execute("SET LOCAL lock_timeout = %s", (SWAP_LOCK_TIMEOUT,))
+
+    live = []
+    for table_name in table_names:
+        cursor.execute("SELECT to_regclass(%s)", (qualified(table_name),))
+        if cursor.fetchone()[0] is not None:
+            live.append(table_name)
+
+    for table_name in live:
+        old = f"{table_name}__old"
+        cursor.execute(f"DROP TABLE IF EXISTS {qualified(old)} CASCADE")
+        cursor.execute(f'ALTER TABLE {qualified(table_name)} RENAME TO "{old}"')
+    for table_name in table_names:
+        cursor.execute(f'ALTER TABLE {qualified(table_name + STAGING_SUFFIX)} RENAME TO "{table_name}"')
+    # CASCADE : les anciennes vues partent avec les anciennes tables,
+    # leurs remplaçantes (déjà construites sur les stagings) prennent leur nom
+    for table_name in live:
+        cursor.execute(f"DROP TABLE {qualified(table_name + '__old')} CASCADE")
+
+    for table_name in table_names:
+        for name, _ in TABLE_INDEXES.get(table_name, []):
+            cursor.execute(f'ALTER INDEX {PG_SCHEMA}."{name}{STAGING_SUFFIX}" RENAME TO "{name}"')
+
+    for schema, name, kind, _, indexes in views:
+        cursor.execute(f'ALTER {view_type(kind)} {schema}."{name}{STAGING_SUFFIX}" RENAME TO "{name}"')
+        for index_name, _ in indexes:
+            cursor.execute(f'ALTER INDEX {schema}."{index_name}{STAGING_SUFFIX}" RENAME TO "{index_name}"')
+
+
+def print_report(stats, publish_s, total_s):
+    print("\n📊 Rapport de chargement")
+    print(f"   {'table':<26}{'lignes':>10}{'MB':>8}{'download':>10}{'copy':>8}{'index':>8}{'lignes/s':>11}{'MB/s':>7}")
+    for st in stats:
+        mb = st["bytes"] / 1e6
+        copy_s = max(st["copy_s"], 1e-9)
+        print(
+            f"   {st['table']:<26}{st['rows']:>10}{mb:>8.2f}{st['download_s']:>9.2f}s"
+            f"{st['copy_s']:>7.2f}s{st['index_s']:>7.2f}s{st['rows'] / copy_s:>11.0f}{mb / copy_s:>7.2f}"
+        )
+    print(f"   Publication atomique : {publish_s:.2f}s — total : {total_s:.2f}s ({LOAD_MODE})")
+
+
+started = time.perf_counter()
+
+# Plus gros fichiers d'abord : les petites tables remplissent les workers libres
+tables = sorted(GOLD_TABLES.items(), key=lambda item: fs.size(item[1]), reverse=True)
+
+print(f"\n📥 Chargement de {len(tables)} tables GOLD ({LOAD_MODE}, {load_workers} worker(s))")
+stats = []
+# Mémoire bornée : au plus deux row groups par table en cours de chargement
+with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as downloader, \
+        ThreadPoolExecutor(max_workers=load_workers) as loader:
+    futures = [loader.submit(stage_table, name, path, downloader) for name, path in tables]
+    for future in as_completed(futures):
+        st = future.result()
+        stats.append(st)
+        print(f"✅ {st['table']} en staging : {st['rows']} lignes")
+
+table_names = [name for name, _ in tables]
+views = stage_views(table_names)
+if views:
+    print(f"♻️ {len(views)} vue(s) reconstruite(s) sur les stagings")
+
+print("🔁 Publication atomique de toutes les tables...")
+publish_started = time.perf_counter()
+conn = engine.raw_connection()
+try:
+    with conn.cursor() as cursor:
+        publish_tables(cursor, table_names, views)
+    conn.commit()
+except Exception:
+    conn.rollback()
+    raise
+finally:
+    conn.close()
+publish_s = time.perf_counter() - publish_started
+
+print_report(sorted(stats, key=lambda st: st["table"]), publish_s, time.perf_counter() - started)
 
 print("\n🎉 TOUTES LES TABLES GOLD ONT ÉTÉ CHARGÉES DANS POSTGRES")
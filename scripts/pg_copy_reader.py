@@ -0,0 +1,172 @@
+"""
+pg_copy_reader.py
+-----------------
+Shared fast reader for PostgreSQL queries.
+
+Instead of `pd.read_sql` (psycopg2 builds one Python object per cell),
+the query is run as `COPY (query) TO STDOUT WITH CSV` and the CSV stream
+is decoded by Arrow's native CSV reader straight into typed columns.
+Column types are taken from the query's result description, so nothing
+is inferred from the data.
+
+Queries COPY can't handle (non-SELECT statements, array / interval /
+other exotic column types, COPY errors) fall back to `pd.read_sql`.
+
+Usage:
+    from pg_copy_reader import read_sql_arrow, read_sql_pandas
+    table = read_sql_arrow("SELECT * FROM rental", engine)
+    df = read_sql_pandas("SELECT * FROM payment WHERE amount > %(x)s", engine, {"x": 5})
+"""
+
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# COPY output is spooled in memory up to this size, then to a temp file
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+# Postgres type OID -> Arrow type
+PG_OID_ARROW_TYPES = {
+    16: pa.bool_(),                     # bool
+    20: pa.int64(),                     # int8
+    21: pa.int16(),                     # int2
+    23: pa.int32(),                     # int4
+    26: pa.int64(),                     # oid
+    700: pa.float32(),                  # float4
+    701: pa.float64(),                  # float8
+    18: pa.string(),                    # char
+    19: pa.string(),                    # name
+    25: pa.string(),                    # text
+    1042: pa.string(),                  # bpchar
+    1043: pa.string(),                  # varchar
+    1082: pa.date32(),                  # date
+    1114: pa.timestamp("us"),           # timestamp
+    1184: pa.timestamp("us", tz="UTC"), # timestamptz
+}
+NUMERIC_OID = 1700
+
+# pg_type.typcategory values whose CSV text is the value itself (enums,
+# user string types): decoded as Arrow strings like read_sql would.
+STRING_CATEGORIES = {"S", "E"}
+
+
+class CopyNotSupported(Exception):
+    """The query result can't be decoded from COPY CSV; use read_sql."""
+
+
+# ======================================================
+# Schema detection
+# ======================================================
+
+def _numeric_type(column) -> pa.DataType:
+    # psycopg2 exposes numeric(p, s) typmod as precision / scale
+    if column.precision is not None and column.scale is not None and 0 < column.precision <= 38:
+        return pa.decimal128(column.precision, column.scale)
+    return pa.float64()
+
+
+def _result_schema(cursor, sql: str) -> pa.Schema:
+    """Describe the query without running it and map each column to Arrow."""
+    cursor.execute(f"SELECT * FROM ({sql}) AS _q LIMIT 0")
+    description = cursor.description
+
+    unknown = {c.type_code for c in description
+               if c.type_code not in PG_OID_ARROW_TYPES and c.type_code != NUMERIC_OID}
+    categories = {}
+    if unknown:
+        cursor.execute(
+            "SELECT oid, typcategory FROM pg_type WHERE oid = ANY(%s)",
+            (list(unknown),)
+        )
+        categories = dict(cursor.fetchall())
+
+    names = [c.name for c in description]
+    if len(set(names)) != len(names):
+        raise CopyNotSupported("duplicate column names")
+
+    fields = []
+    for c in description:
+        if c.type_code == NUMERIC_OID:
+            arrow_type = _numeric_type(c)
+        elif c.type_code in PG_OID_ARROW_TYPES:
+            arrow_type = PG_OID_ARROW_TYPES[c.type_code]
+        elif categories.get(c.type_code) in STRING_CATEGORIES:
+            arrow_type = pa.string()
+        else:
+            raise CopyNotSupported(f"column '{c.name}' has unsupported type oid {c.type_code}")
+        fields.append(pa.field(c.name, arrow_type))
+    return pa.schema(fields)
+
+
+# ======================================================
+# Readers
+# ======================================================
+
+def _copy_to_arrow(sql: str, engine, params=None) -> pa.Table:
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if params:
+            sql = cursor.mogrify(sql, params).decode("utf-8")
+        sql = sql.strip().rstrip(";")
+
+        first_word = sql.split(None, 1)[0].lower() if sql else ""
+        if first_word not in ("select", "with", "values", "table"):
+            raise CopyNotSupported("only SELECT-like queries can be copied")
+
+        # timestamptz values come back as '+00' offsets Arrow can parse
+        cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+        schema = _result_schema(cursor, sql)
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as buffer:
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+            buffer.seek(0)
+
+            table = pacsv.read_csv(
+                buffer,
+                read_options=pacsv.ReadOptions(use_threads=True),
+                convert_options=pacsv.ConvertOptions(
+                    column_types=schema,
+                    # COPY writes NULL as an unquoted empty field and an
+                    # empty string as "" -> only the former becomes null
+                    null_values=[""],
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                    true_values=["t"],
+                    false_values=["f"],
+                ),
+            )
+        conn.rollback()
+        return table
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def read_sql_arrow(sql: str, engine, params=None) -> pa.Table:
+    """Run `sql` and return an Arrow table (COPY fast path, read_sql fallback)."""
+    try:
+        return _copy_to_arrow(sql, engine, params)
+    except CopyNotSupported:
+        pass
+    except Exception as e:
+        print(f"⚠️ COPY fast path failed ({e}); falling back to read_sql")
+
+    return pa.Table.from_pandas(pd.read_sql(sql, engine, params=params), preserve_index=False)
+
+
+def read_sql_pandas(sql: str, engine, params=None) -> pd.DataFrame:
+    """Run `sql` and return a pandas DataFrame (COPY fast path, read_sql fallback)."""
+    try:
+        table = _copy_to_arrow(sql, engine, params)
+    except CopyNotSupported:
+        return pd.read_sql(sql, engine, params=params)
+    except Exception as e:
+        print(f"⚠️ COPY fast path failed ({e}); falling back to read_sql")
+        return pd.read_sql(sql, engine, params=params)
+
+    # self_destruct frees Arrow buffers as they are handed to pandas
+    return table.to_pandas(split_blocks=True, self_destruct=True)
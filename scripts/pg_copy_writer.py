@@ -0,0 +1,113 @@
+"""
+pg_copy_writer.py
+-----------------
+Arrow -> PostgreSQL side of the Gold load (counterpart of pg_copy_reader).
+
+- pg_type() derives each staging column's Postgres type from the Parquet
+  Arrow schema, so no data is scanned to infer types.
+- to_copy_csv() turns an Arrow record batch into the CSV text that
+  `COPY ... FROM STDIN WITH (FORMAT csv)` expects. Conversion is done with
+  Arrow compute kernels; only rare nested types (-> jsonb) go through
+  Python values.
+
+CSV conventions: NULL is an unquoted empty field, strings are always
+quoted (so "" is the empty string), list<string> becomes a text[] literal
+{"a","b",NULL}.
+"""
+
+import io
+import json
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+
+# ======================================================
+# Types: Arrow schema -> Postgres column types (O(columns))
+# ======================================================
+
+def pg_type(arrow_type: pa.DataType) -> str:
+    """Postgres type of a column, from its Arrow type."""
+    if pa.types.is_dictionary(arrow_type):          # pandas category
+        return pg_type(arrow_type.value_type)
+    if pa.types.is_boolean(arrow_type):
+        return "boolean"
+    if pa.types.is_int8(arrow_type) or pa.types.is_int16(arrow_type) or pa.types.is_uint8(arrow_type):
+        return "smallint"
+    if pa.types.is_int32(arrow_type) or pa.types.is_uint16(arrow_type):
+        return "integer"
+    if pa.types.is_integer(arrow_type):
+        return "bigint"
+    if pa.types.is_float16(arrow_type) or pa.types.is_float32(arrow_type):
+        return "real"
+    if pa.types.is_floating(arrow_type):
+        return "double precision"
+    if pa.types.is_decimal(arrow_type):
+        return f"numeric({arrow_type.precision}, {arrow_type.scale})"
+    if pa.types.is_timestamp(arrow_type):
+        return "timestamptz" if arrow_type.tz else "timestamp"
+    if pa.types.is_date(arrow_type):
+        return "date"
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "text"
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return "bytea"
+    if is_string_list(arrow_type):
+        return "text[]"
+    # Non-text lists, structs, maps...
+    return "jsonb"
+
+
+def is_string_list(arrow_type: pa.DataType) -> bool:
+    return (
+        (pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type))
+        and (pa.types.is_string(arrow_type.value_type) or pa.types.is_large_string(arrow_type.value_type))
+    )
+
+
+# ======================================================
+# Vectorized conversion to COPY text
+# ======================================================
+
+def to_pg_text_array(column: pa.Array) -> pa.Array:
+    """list<string> -> Postgres array literal {"a","b"} (Arrow kernels, no Python loop)."""
+    # flatten() honours the slice offset and skips values hidden behind null
+    # lists; .values would be the whole child array of the unsliced parent
+    values = column.flatten()
+    escaped = pc.replace_substring(pc.replace_substring(values, "\\", "\\\\"), '"', '\\"')
+    quoted = pc.binary_join_element_wise('"', escaped, '"', "")
+    quoted = pc.if_else(pc.is_null(values), pa.scalar("NULL"), quoted)
+
+    # Offsets rebuilt from 0 over the flattened values (null lists have length 0)
+    offset_type = pa.int64() if pa.types.is_large_list(column.type) else pa.int32()
+    lengths = pc.fill_null(pc.list_value_length(column), 0).cast(offset_type)
+    offsets = pa.concat_arrays([pa.array([0], type=offset_type), pc.cumulative_sum(lengths)])
+    lists = type(column).from_arrays(offsets, quoted, mask=column.is_null())
+    joined = pc.binary_join(lists, ",")
+    return pc.binary_join_element_wise("{", joined, "}", "")
+
+
+def to_copy_column(column: pa.Array) -> pa.Array:
+    arrow_type = column.type
+    if pa.types.is_dictionary(arrow_type):
+        return to_copy_column(column.dictionary_decode())
+    if is_string_list(arrow_type):
+        return to_pg_text_array(column)
+    if pg_type(arrow_type) == "jsonb":
+        # Rare nested types: encoded value by value
+        return pa.array([None if v is None else json.dumps(v, default=str) for v in column.to_pylist()],
+                        type=pa.string())
+    return column
+
+
+def to_copy_csv(batch: pa.RecordBatch) -> io.BytesIO:
+    """CSV body (no header) for COPY FROM STDIN WITH (FORMAT csv), rewound."""
+    batch = pa.RecordBatch.from_arrays(
+        [to_copy_column(column) for column in batch.columns],
+        names=batch.schema.names
+    )
+    buffer = io.BytesIO()
+    # NULL -> unquoted empty field; strings are quoted ("" = empty string)
+    pacsv.write_csv(batch, buffer, write_options=pacsv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    return buffer
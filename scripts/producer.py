@@ -1,40 +1,322 @@
-import json
+import os
 import time
 import random
+import multiprocessing
+import pandas as pd
+import s3fs
 from kafka import KafkaProducer
 from datetime import datetime
+from bronze_dataset import read_bronze_table
+from rental_codec import RentalCodec
 
-# Connexion au broker Kafka
-producer = KafkaProducer(
-    bootstrap_servers=['localhost:9092'],
-    api_version=(0, 10, 1), # Très important pour la compatibilité
-    value_serializer=lambda v: json.dumps(v).encode('utf-8'),
-    acks='all' # Garantit que Kafka a bien reçu le message
-)
+# ======================================================
+# CONFIGURATION
+# ======================================================
+
+KAFKA_TOPIC = "dvd_rentals"
+KAFKA_SERVER = "localhost:9092"
+
+# simulate = une location aléatoire toutes les 3 secondes (comportement d'origine)
+# load     = générateur de charge à débit cible (events/s), multi-processus
+# replay   = rejoue les vraies lignes de bronze rental.parquet dans l'ordre de rental_date
+PRODUCER_MODE = os.getenv("PRODUCER_MODE", "simulate")
+
+# -------- Générateur de charge --------
+TARGET_RATE = float(os.getenv("TARGET_RATE", "1000"))          # events/s, tous processus confondus
+PRODUCER_PROCESSES = int(os.getenv("PRODUCER_PROCESSES", "1"))
+LOAD_DURATION_S = float(os.getenv("LOAD_DURATION_S", "60"))
+# rental_id croissants (processus entrelacés) au-delà des vraies locations :
+# chaque event est un INSERT, pas une mise à jour d'une ligne tirée au hasard.
+# À relever entre deux runs pour ne pas réécrire les lignes du run précédent.
+LOAD_ID_START = int(os.getenv("LOAD_ID_START", "1000000"))
+
+# -------- Replay historique --------
+REPLAY_SPEEDUP = float(os.getenv("REPLAY_SPEEDUP", "1000"))    # 1000 = 1000x plus vite que le réel
+BRONZE_PATH = f"s3://{os.getenv('BRONZE_BUCKET', 'bronze')}/dvdrental/"
+
+# -------- Réglages du producer Kafka --------
+LINGER_MS = int(os.getenv("LINGER_MS", "5"))
+BATCH_SIZE_BYTES = int(os.getenv("BATCH_SIZE_BYTES", "65536"))
+COMPRESSION = os.getenv("COMPRESSION", "lz4")                 # none | gzip | snappy | lz4 | zstd
+
+# json    = objet JSON par message (format d'origine)
+# msgpack = binaire compact : id de schéma (schemas/dvd_rentals/) + valeurs dans l'ordre des champs
+MESSAGE_CODEC = os.getenv("MESSAGE_CODEC", "json")
+codec = RentalCodec(MESSAGE_CODEC)
+
+# Nombre max de latences d'ack conservées par processus pour les percentiles
+LATENCY_SAMPLE_SIZE = 100_000
 
 categories = ['Action', 'Comedy', 'Drama', 'Horror', 'Sci-Fi']
 films = ['Academy Dinosaur', 'Bucket Brotherhood', 'Chamber Italian', 'Grosse Wonderful']
 
-print("🚀 Simulateur de locations démarré...")
-
-try:
-    while True:
-        # Création d'une donnée factice (simulant une nouvelle ligne en zone Bronze)
-        data = {
-            'rental_id': random.randint(20000, 99999),
-            'customer_id': random.randint(1, 600),
-            'film_id': random.randint(1, 1000),
-            'title': random.choice(films),
-            'category': random.choice(categories),
-            'rental_rate': round(random.uniform(2.99, 9.99), 2),
-            'rental_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'actual_rental_duration': random.randint(1, 7)
-        }
-        
-        # Envoi au topic
-        producer.send('dvd_rentals', value=data)
-        print(f"📡 Envoi : {data['title']} ({data['category']}) - {data['rental_rate']}€")
-        
-        time.sleep(3) # Simule une vente toutes les 3 secondes
-except KeyboardInterrupt:
-    print("Stopping...")
\ No newline at end of file
+
+def create_producer(tuned=False):
+    # Connexion au broker Kafka
+    if not tuned:
+        return KafkaProducer(
+            bootstrap_servers=[KAFKA_SERVER],
+            api_version=(0, 10, 1), # Très important pour la compatibilité
+            value_serializer=codec.encode,
+            acks='all' # Garantit que Kafka a bien reçu le message
+        )
+
+    # Mode charge / replay : clé = customer_id (même client -> même partition),
+    # envoi par lots (linger_ms, batch_size) et compression
+    return KafkaProducer(
+        bootstrap_servers=[KAFKA_SERVER],
+        api_version=(0, 10, 1),
+        key_serializer=lambda k: str(k).encode('utf-8'),
+        value_serializer=codec.encode,
+        acks='all',
+        linger_ms=LINGER_MS,
+        batch_size=BATCH_SIZE_BYTES,
+        compression_type=None if COMPRESSION == "none" else COMPRESSION,
+    )
+
+
+def random_rental(rental_id=None):
+    # Création d'une donnée factice (simulant une nouvelle ligne en zone Bronze)
+    return {
+        'rental_id': random.randint(20000, 99999) if rental_id is None else rental_id,
+        'customer_id': random.randint(1, 600),
+        'film_id': random.randint(1, 1000),
+        'title': random.choice(films),
+        'category': random.choice(categories),
+        'rental_rate': round(random.uniform(2.99, 9.99), 2),
+        'rental_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'actual_rental_duration': random.randint(1, 7),
+        # Horodatage d'émission (epoch ms) pour la latence de bout en bout
+        '_produced_at': int(time.time() * 1000)
+    }
+
+
+# ======================================================
+# MESURES : débit et latence d'ack du broker
+# ======================================================
+
+class AckStats:
+    """Compte les envois et mesure la latence send() -> ack du broker."""
+
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.errors = 0
+        self.latencies_ms = []
+
+    def send(self, producer, value, key=None):
+        sent_at = time.perf_counter()
+        future = producer.send(KAFKA_TOPIC, key=key, value=value)
+        future.add_callback(self._on_ack, sent_at)
+        future.add_errback(self._on_error)
+        self.sent += 1
+
+    def _on_ack(self, sent_at, _metadata):
+        self.acked += 1
+        latency = (time.perf_counter() - sent_at) * 1000
+        # Échantillonnage réservoir pour borner la mémoire
+        if len(self.latencies_ms) < LATENCY_SAMPLE_SIZE:
+            self.latencies_ms.append(latency)
+        else:
+            i = random.randrange(self.acked)
+            if i < LATENCY_SAMPLE_SIZE:
+                self.latencies_ms[i] = latency
+
+    def _on_error(self, _exc):
+        self.errors += 1
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def print_report(sent, acked, errors, latencies_ms, elapsed):
+    latencies_ms = sorted(latencies_ms)
+    print("-" * 50)
+    print(f"📊 Envoyés : {sent} | Ackés : {acked} | Erreurs : {errors} | Durée : {elapsed:.1f}s")
+    print(f"🚀 Débit atteint : {acked / elapsed:,.0f} events/s" if elapsed else "🚀 Débit atteint : n/a")
+    print(
+        "⏱️  Latence d'ack (ms) : "
+        f"p50={percentile(latencies_ms, 50):.1f} "
+        f"p95={percentile(latencies_ms, 95):.1f} "
+        f"p99={percentile(latencies_ms, 99):.1f} "
+        f"max={latencies_ms[-1] if latencies_ms else float('nan'):.1f}"
+    )
+
+
+# ======================================================
+# MODE SIMULATE (d'origine)
+# ======================================================
+
+def run_simulate():
+    producer = create_producer()
+    print("🚀 Simulateur de locations démarré...")
+
+    try:
+        while True:
+            data = random_rental()
+
+            # Envoi au topic
+            producer.send(KAFKA_TOPIC, value=data)
+            print(f"📡 Envoi : {data['title']} ({data['category']}) - {data['rental_rate']}€")
+
+            time.sleep(3) # Simule une vente toutes les 3 secondes
+    except KeyboardInterrupt:
+        print("Stopping...")
+
+
+# ======================================================
+# MODE LOAD : débit cible, plusieurs processus
+# ======================================================
+
+def load_worker(worker_id, rate, duration, results):
+    producer = create_producer(tuned=True)
+    stats = AckStats()
+    start = time.perf_counter()
+
+    try:
+        while True:
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration:
+                break
+            # Rattrape le nombre d'events attendu à cet instant, sinon attend 1 ms
+            due = int(elapsed * rate)
+            if stats.sent >= due:
+                time.sleep(0.001)
+                continue
+            for _ in range(due - stats.sent):
+                rental_id = LOAD_ID_START + worker_id + stats.sent * PRODUCER_PROCESSES
+                data = random_rental(rental_id)
+                stats.send(producer, data, key=data['customer_id'])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        producer.flush()
+        elapsed = time.perf_counter() - start
+        producer.close()
+
+    results.put((stats.sent, stats.acked, stats.errors, stats.latencies_ms, elapsed))
+
+
+def run_load():
+    per_process_rate = TARGET_RATE / PRODUCER_PROCESSES
+    print(
+        f"🚀 Générateur de charge : {TARGET_RATE:,.0f} events/s cible sur "
+        f"{PRODUCER_PROCESSES} processus pendant {LOAD_DURATION_S:.0f}s "
+        f"(linger_ms={LINGER_MS}, batch_size={BATCH_SIZE_BYTES}, compression={COMPRESSION})"
+    )
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=load_worker, args=(i, per_process_rate, LOAD_DURATION_S, results))
+        for i in range(PRODUCER_PROCESSES)
+    ]
+    for p in processes:
+        p.start()
+
+    outcomes = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+
+    print_report(
+        sent=sum(o[0] for o in outcomes),
+        acked=sum(o[1] for o in outcomes),
+        errors=sum(o[2] for o in outcomes),
+        latencies_ms=[l for o in outcomes for l in o[3]],
+        # Les processus tournent en parallèle : la durée est celle du plus long
+        elapsed=max(o[4] for o in outcomes),
+    )
+
+
+# ======================================================
+# MODE REPLAY : vraies locations Bronze, temps accéléré
+# ======================================================
+
+def film_details(fs):
+    """
+    Film, titre, catégorie et tarif par inventory_id, depuis Bronze : les
+    events rejoués portent les mêmes colonnes que le fait Gold, pour que
+    l'upsert du consumer ne remplace pas une vraie ligne par des NULL.
+    """
+    def bronze(table, columns):
+        return read_bronze_table(fs, table, columns=columns, bronze_path=BRONZE_PATH)
+
+    films = bronze("film", ["film_id", "title", "rental_rate"]) \
+        .merge(bronze("film_category", ["film_id", "category_id"]).drop_duplicates("film_id"), on="film_id", how="left") \
+        .merge(bronze("category", ["category_id", "name"]), on="category_id", how="left") \
+        .rename(columns={"name": "category"})
+    # Même casse que save_silver.py
+    films["title"] = films["title"].str.title()
+    return bronze("inventory", ["inventory_id", "film_id"]) \
+        .merge(films[["film_id", "title", "category", "rental_rate"]], on="film_id", how="left")
+
+
+def optional(value, cast):
+    return None if pd.isna(value) else cast(value)
+
+
+def run_replay():
+    fs = s3fs.S3FileSystem(
+        key=os.getenv("AWS_ACCESS_KEY_ID", "minioadmin"),
+        secret=os.getenv("AWS_SECRET_ACCESS_KEY", "minioadmin"),
+        client_kwargs={'endpoint_url': os.getenv("AWS_ENDPOINT_URL", "http://localhost:9000")}
+    )
+
+    columns = ['rental_id', 'rental_date', 'inventory_id', 'customer_id', 'return_date', 'staff_id']
+    rentals = read_bronze_table(fs, "rental", columns=columns, bronze_path=BRONZE_PATH)
+    if rentals.empty:
+        print("⚠️ Aucune location dans Bronze rental : rien à rejouer")
+        return
+    rentals = rentals.merge(film_details(fs), on="inventory_id", how="left")
+    rentals = rentals.sort_values("rental_date", kind="stable").reset_index(drop=True)
+    print(f"🚀 Replay de {len(rentals)} locations à x{REPLAY_SPEEDUP:g}")
+
+    producer = create_producer(tuned=True)
+    stats = AckStats()
+    first_event = rentals["rental_date"].iloc[0]
+    start = time.perf_counter()
+
+    try:
+        for row in rentals.itertuples(index=False):
+            # Position de l'event dans le temps rejoué
+            due_at = (row.rental_date - first_event).total_seconds() / REPLAY_SPEEDUP
+            wait = due_at - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+
+            data = {
+                'rental_id': int(row.rental_id),
+                'rental_date': row.rental_date.strftime("%Y-%m-%d %H:%M:%S"),
+                'inventory_id': int(row.inventory_id),
+                'customer_id': int(row.customer_id),
+                'return_date': None if pd.isna(row.return_date) else row.return_date.strftime("%Y-%m-%d %H:%M:%S"),
+                'staff_id': int(row.staff_id),
+                'film_id': optional(row.film_id, int),
+                'title': optional(row.title, str),
+                'category': optional(row.category, str),
+                'rental_rate': optional(row.rental_rate, float),
+                'actual_rental_duration': None if pd.isna(row.return_date) else (row.return_date - row.rental_date).days,
+                '_produced_at': int(time.time() * 1000),
+            }
+            stats.send(producer, data, key=data['customer_id'])
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        producer.flush()
+        elapsed = time.perf_counter() - start
+        producer.close()
+
+    print_report(stats.sent, stats.acked, stats.errors, stats.latencies_ms, elapsed)
+
+
+if __name__ == "__main__":
+    if PRODUCER_MODE == "load":
+        run_load()
+    elif PRODUCER_MODE == "replay":
+        run_replay()
+    else:
+        run_simulate()
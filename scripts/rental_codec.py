@@ -0,0 +1,160 @@
+"""
+rental_codec.py
+---------------
+Message encoding for the dvd_rentals topic.
+
+Codecs:
+- json    : UTF-8 JSON object per message (original format, kept for compatibility)
+- msgpack : schema-based binary encoding. The payload is
+            [magic byte 0x00][4-byte big-endian schema id][MessagePack array]
+            where the array holds the values in the schema's field order,
+            so field names are not repeated in every message.
+
+Schemas live in a local file-based registry (stand-in for a schema
+registry service): schemas/<subject>/<id>.json, the highest id being the
+one producers write with. Consumers look the id up from each message.
+
+decode_batch() turns a whole poll batch into one Arrow table: binary
+messages are unpacked into value arrays and built column by column with
+the schema's types; JSON messages still go through dicts.
+"""
+
+import os
+import json
+import struct
+import msgpack
+import pyarrow as pa
+
+MAGIC_BYTE = 0
+HEADER = struct.Struct(">bI")
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas")
+
+ARROW_TYPES = {
+    "int64": pa.int64(),
+    "float64": pa.float64(),
+    "string": pa.string(),
+    "bool": pa.bool_(),
+}
+
+
+# ======================================================
+# Local schema registry
+# ======================================================
+
+class LocalSchemaRegistry:
+    """Schemas stored as schemas/<subject>/<id>.json files."""
+
+    def __init__(self, schema_dir=SCHEMA_DIR):
+        self.schema_dir = schema_dir
+        self.by_id = {}
+        self.latest_by_subject = {}
+        for subject in sorted(os.listdir(schema_dir)):
+            subject_dir = os.path.join(schema_dir, subject)
+            if not os.path.isdir(subject_dir):
+                continue
+            for filename in os.listdir(subject_dir):
+                if not filename.endswith(".json"):
+                    continue
+                with open(os.path.join(subject_dir, filename)) as f:
+                    schema = json.load(f)
+                schema["arrow_schema"] = pa.schema(
+                    [pa.field(fld["name"], ARROW_TYPES[fld["type"]]) for fld in schema["fields"]]
+                )
+                schema["names"] = [fld["name"] for fld in schema["fields"]]
+                self.by_id[schema["id"]] = schema
+                latest = self.latest_by_subject.get(subject)
+                if latest is None or schema["id"] > latest["id"]:
+                    self.latest_by_subject[subject] = schema
+
+    def get(self, schema_id):
+        try:
+            return self.by_id[schema_id]
+        except KeyError:
+            raise ValueError(f"Unknown schema id {schema_id} (not in {self.schema_dir})")
+
+    def latest(self, subject):
+        return self.latest_by_subject[subject]
+
+
+# ======================================================
+# Codec
+# ======================================================
+
+class RentalCodec:
+    """Encoder/decoder for dvd_rentals messages (json or msgpack)."""
+
+    def __init__(self, codec="json", subject="dvd_rentals", registry=None):
+        if codec not in ("json", "msgpack"):
+            raise ValueError(f"Unknown codec '{codec}' (expected json or msgpack)")
+        self.codec = codec
+        self.registry = registry or LocalSchemaRegistry()
+        self.schema = self.registry.latest(subject)
+
+    # -------- producer side --------
+    def encode(self, value: dict) -> bytes:
+        if self.codec == "json":
+            return json.dumps(value).encode("utf-8")
+
+        unknown = set(value) - set(self.schema["names"])
+        if unknown:
+            raise ValueError(f"Fields not in schema {self.schema['id']}: {sorted(unknown)}")
+        row = [value.get(name) for name in self.schema["names"]]
+        return HEADER.pack(MAGIC_BYTE, self.schema["id"]) + msgpack.packb(row)
+
+    # -------- consumer side --------
+    @staticmethod
+    def is_framed(payload: bytes) -> bool:
+        return len(payload) >= HEADER.size and payload[0] == MAGIC_BYTE
+
+    def decode(self, payload: bytes) -> dict:
+        """Decode one message (either codec) to a dict."""
+        if not self.is_framed(payload):
+            return json.loads(payload.decode("utf-8"))
+        _, schema_id = HEADER.unpack_from(payload)
+        names = self.registry.get(schema_id)["names"]
+        values = msgpack.unpackb(payload[HEADER.size:])
+        # Missing values are omitted, like absent keys in the JSON format
+        return {name: v for name, v in zip(names, values) if v is not None}
+
+    def decode_batch(self, payloads) -> pa.Table:
+        """Decode a poll batch (mixed codecs allowed) into one Arrow table."""
+        framed = {}
+        framed_positions = {}
+        json_rows = []
+        json_positions = []
+        for i, payload in enumerate(payloads):
+            if self.is_framed(payload):
+                _, schema_id = HEADER.unpack_from(payload)
+                framed.setdefault(schema_id, []).append(msgpack.unpackb(payload[HEADER.size:]))
+                framed_positions.setdefault(schema_id, []).append(i)
+            else:
+                json_rows.append(json.loads(payload.decode("utf-8")))
+                json_positions.append(i)
+
+        tables = []
+        positions = []
+        for schema_id, rows in framed.items():
+            schema = self.registry.get(schema_id)["arrow_schema"]
+            columns = list(zip(*rows))
+            arrays = [pa.array(col, type=field.type) for col, field in zip(columns, schema)]
+            table = pa.Table.from_arrays(arrays, schema=schema)
+            # Drop fields no message in the batch carried (JSON has no such column either)
+            keep = [name for name, col in zip(table.column_names, table.columns) if col.null_count < len(col)]
+            tables.append(table.select(keep))
+            positions += framed_positions[schema_id]
+        if json_rows:
+            tables.append(pa.Table.from_pylist(json_rows))
+            positions += json_positions
+
+        if not tables:
+            return pa.table({})
+        if len(tables) == 1:
+            return tables[0]
+        try:
+            table = pa.concat_tables(tables, promote_options="default")
+        except TypeError:
+            # pyarrow < 14
+            table = pa.concat_tables(tables, promote=True)
+        # Mixed codecs: restore the original message order
+        order = sorted(range(len(positions)), key=positions.__getitem__)
+        return table.take(pa.array(order))
@@ -1,5 +1,8 @@
+import json
 import pandas as pd
 import s3fs
+from dtype_plan import MemoryReport, apply_dtype_plan, read_parquet, write_parquet
+from kpi_state import KPI_GROUPS, finalize_state, merge_states, partial_state
 
 print("🚀 Starting GOLD layer creation...")
 
@@ -25,122 +28,274 @@ else:
     print(f"🪣 Bucket '{GOLD_BUCKET}' already exists")
 
 # ----------------------------
-# Load SILVER tables
+# Incremental or full run
 # ----------------------------
-print("📥 Loading Silver tables from MinIO...")
+# Gold keeps the Silver month partitions (fact_rental_gold/month=YYYY-MM/).
+# KPIs are kept as mergeable partial states (count, sum, sum of squares,
+# min, max per category, day, title, customer and globally, see
+# kpi_state.py). When the stored Gold matches the current Silver rebuild,
+# only the Silver change-log files not folded yet are read: they are merged
+# into the stored states, and only the months they touch are re-read from
+# Silver and rewritten. A full Silver rebuild (or missing Gold outputs)
+# recomputes everything from the whole Silver fact.
+KPI_PROGRESS_PATH = f"s3://{GOLD_BUCKET}/_state/kpi_state.json"
+SILVER_STATE_PATH = f"s3://{SILVER_BUCKET}/_state/silver_watermarks.json"
+SILVER_CHANGES_PATH = f"s3://{SILVER_BUCKET}/_changes/fact_rental/"
+SILVER_FACT_PATH = f"s3://{SILVER_BUCKET}/fact_rental/"
+GOLD_FACT_PATH = f"s3://{GOLD_BUCKET}/fact_rental_gold/"
+# Single-object layout written before the Gold fact was month-partitioned
+GOLD_FACT_LEGACY_PATH = f"s3://{GOLD_BUCKET}/fact_rental_gold.parquet"
+DIM_TIME_PATH = f"s3://{GOLD_BUCKET}/dim_time.parquet"
+PARTITION_COLUMN = "month"
 
-fact_rental = pd.read_parquet(
-    f"s3://{SILVER_BUCKET}/fact_rental.parquet",
-    filesystem=fs
+
+def kpi_state_path(kpi):
+    return f"s3://{GOLD_BUCKET}/gold_kpi_{kpi}_state.parquet"
+
+
+def partition_path(base, month):
+    return f"{base}{PARTITION_COLUMN}={month}/"
+
+
+def month_of(rental_date):
+    # Same partition key as save_silver.py
+    return rental_date.dt.strftime("%Y-%m").fillna("__HIVE_DEFAULT_PARTITION__")
+
+
+def load_json(path):
+    if not fs.exists(path):
+        return {}
+    with fs.open(path, "r") as f:
+        return json.load(f)
+
+
+silver_rebuild = load_json(SILVER_STATE_PATH).get("_full_rebuild")
+kpi_progress = load_json(KPI_PROGRESS_PATH)
+change_files = sorted(fs.ls(SILVER_CHANGES_PATH)) if fs.exists(SILVER_CHANGES_PATH) else []
+
+fold_increments = (
+    silver_rebuild is not None
+    and kpi_progress.get("silver_rebuild") == silver_rebuild
+    and all(fs.exists(kpi_state_path(kpi)) for kpi in KPI_GROUPS)
+    and fs.exists(GOLD_FACT_PATH)
+    and fs.exists(DIM_TIME_PATH)
 )
 
-dim_film = pd.read_parquet(
+# ----------------------------
+# Load SILVER tables
+# ----------------------------
+print("📥 Loading Silver tables from MinIO...")
+
+dim_film = read_parquet(
     f"s3://{SILVER_BUCKET}/dim_film.parquet",
     filesystem=fs
 )
 
+
+def to_date_key(dates):
+    """Integer surrogate key YYYYMMDD (null for missing dates)."""
+    return (dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).astype("Int32")
+
+
+if fold_increments:
+    folded = set(kpi_progress.get("folded", []))
+    new_files = [f for f in change_files if f not in folded]
+    print(f"🔁 {len(new_files)} new Silver change file(s)")
+
+    film_length = dim_film[["film_id", "length"]].drop_duplicates("film_id")
+    deltas = []
+    for f in new_files:
+        log = read_parquet(f, filesystem=fs)
+        log = log.merge(film_length, on="film_id", how="left")
+        log["date_key"] = to_date_key(log["rental_date"])
+        deltas.append(log)
+
+    # Retractions carry the old rental_date: a rental that moved month
+    # rewrites both its old and its new partition
+    months = sorted({m for log in deltas for m in month_of(log["rental_date"])})
+    # read_parquet restores the compact Silver dtypes (decimals, lists)
+    parts = [
+        read_parquet(partition_path(SILVER_FACT_PATH, m), filesystem=fs, exclude=[PARTITION_COLUMN])
+        for m in months if fs.exists(partition_path(SILVER_FACT_PATH, m))
+    ]
+    fact_rental = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    print(f"✅ {len(months)} Silver partition(s) re-read")
+else:
+    # The partition key is a storage detail and is not carried into gold
+    fact_rental = read_parquet(SILVER_FACT_PATH, filesystem=fs, exclude=[PARTITION_COLUMN])
+    months = None
+
 print("✅ Silver tables loaded")
 print("fact_rental shape:", fact_rental.shape)
 print("dim_film shape:", dim_film.shape)
 
 # ----------------------------
-# Build TIME dimension
+# Build FACT_RENTAL_GOLD
 # ----------------------------
-print("🕒 Building Time dimension...")
+print("📊 Building fact_rental_gold...")
+
+memory_report = MemoryReport()
 
-dim_time = (
-    fact_rental[['rental_date']]
-    .dropna()
-    .drop_duplicates()
-    .assign(
-        date=lambda df: df['rental_date'].dt.date,
-        year=lambda df: df['rental_date'].dt.year,
-        month=lambda df: df['rental_date'].dt.month,
-        day=lambda df: df['rental_date'].dt.day,
-        day_of_week=lambda df: df['rental_date'].dt.day_name(),
-        week=lambda df: df['rental_date'].dt.isocalendar().week
+if len(fact_rental):
+    fact_rental_gold = fact_rental.merge(
+        dim_film,
+        on="film_id",
+        how="left",
+        suffixes=("", "_film")
     )
-    .drop(columns=['rental_date'])
-    .reset_index(drop=True)
-)
 
-print("✅ dim_time created")
+    # Normalize column names
+    if "rental_rate" not in fact_rental_gold.columns and "rental_rate_film" in fact_rental_gold.columns:
+        fact_rental_gold["rental_rate"] = fact_rental_gold["rental_rate_film"]
 
-# ----------------------------
-# Build FACT_RENTAL_GOLD
-# ----------------------------
-print("📊 Building fact_rental_gold...")
-
-fact_rental_gold = fact_rental.merge(
-    dim_film,
-    on="film_id",
-    how="left",
-    suffixes=("", "_film")
-)
+    if "category" not in fact_rental_gold.columns and "category_film" in fact_rental_gold.columns:
+        fact_rental_gold["category"] = fact_rental_gold["category_film"]
 
-# Normalize column names
-if "rental_rate" not in fact_rental_gold.columns and "rental_rate_film" in fact_rental_gold.columns:
-    fact_rental_gold["rental_rate"] = fact_rental_gold["rental_rate_film"]
+    required_cols = {
+        "film_id",
+        "category",
+        "rental_rate",
+        "length",
+        "replacement_cost"
+    }
 
-if "category" not in fact_rental_gold.columns and "category_film" in fact_rental_gold.columns:
-    fact_rental_gold["category"] = fact_rental_gold["category_film"]
+    missing = required_cols - set(fact_rental_gold.columns)
+    if missing:
+        raise ValueError(f"❌ Missing columns in fact_rental_gold: {missing}")
 
-required_cols = {
-    "film_id",
-    "category",
-    "rental_rate",
-    "length",
-    "replacement_cost"
-}
+    # Precomputed join key to dim_time (avoids casting rental_date in SQL)
+    fact_rental_gold["date_key"] = to_date_key(fact_rental_gold["rental_date"])
 
-missing = required_cols - set(fact_rental_gold.columns)
-if missing:
-    raise ValueError(f"❌ Missing columns in fact_rental_gold: {missing}")
+    # Merged columns (incl. "_film" duplicates) back to the compact plan
+    fact_rental_gold = apply_dtype_plan(fact_rental_gold, "fact_rental_gold", memory_report)
+else:
+    # Nothing re-read: no change files, or changed months now empty
+    fact_rental_gold = pd.DataFrame({"rental_date": pd.Series(dtype="datetime64[ns]")})
 
 print("✅ fact_rental_gold created")
 print("fact_rental_gold shape:", fact_rental_gold.shape)
 
+# ----------------------------
+# Build TIME dimension
+# ----------------------------
+print("🕒 Building Time dimension...")
+
+# Calendar: one row per day over the fact's date range (no gaps, no duplicates).
+# Incremental runs only extend the stored range with the re-read months
+start = fact_rental_gold['rental_date'].min()
+end = fact_rental_gold['rental_date'].max()
+dim_time_changed = True
+if fold_increments:
+    stored_dates = pd.to_datetime(read_parquet(DIM_TIME_PATH, filesystem=fs, columns=["date"])["date"])
+    stored_start, stored_end = stored_dates.min(), stored_dates.max()
+    dim_time_changed = (
+        (pd.notna(start) and start.normalize() < stored_start)
+        or (pd.notna(end) and end.normalize() > stored_end)
+    )
+    start = stored_start if pd.isna(start) else min(start, stored_start)
+    end = stored_end if pd.isna(end) else max(end, stored_end)
+
+if dim_time_changed:
+    calendar = pd.Series(
+        pd.date_range(
+            start.normalize(),
+            end.normalize(),
+            freq="D"
+        )
+    )
+
+    dim_time = pd.DataFrame({
+        "date_key": to_date_key(calendar),
+        "date": calendar.dt.date,
+        "year": calendar.dt.year,
+        "quarter": calendar.dt.quarter,
+        "month": calendar.dt.month,
+        "day": calendar.dt.day,
+        "day_of_week": calendar.dt.day_name(),
+        "week": calendar.dt.isocalendar().week,
+        "is_weekend": calendar.dt.dayofweek >= 5,
+    })
+
+    dim_time = apply_dtype_plan(dim_time, "dim_time", memory_report)
+
+    print(f"✅ dim_time created ({len(dim_time)} days)")
+else:
+    print("⏭️ dim_time already covers the changed dates, not rewritten")
+
 # ----------------------------
 # Business Aggregations (GOLD)
 # ----------------------------
 print("📈 Creating aggregated business metrics...")
 
-gold_kpi_category = (
-    fact_rental_gold
-    .groupby("category", dropna=False)
-    .agg(
-        total_rentals=("rental_id", "count"),
-        avg_rental_rate=("rental_rate", "mean"),
-        avg_film_length=("length", "mean"),
-        avg_replacement_cost=("replacement_cost", "mean")
-    )
-    .reset_index()
-    .round(2)
-)
+if fold_increments:
+    print(f"🔁 Folding {len(deltas)} change file(s) into KPI states")
+    kpi_states = {
+        kpi: merge_states(
+            read_parquet(kpi_state_path(kpi), filesystem=fs),
+            *[partial_state(log, kpi) for log in deltas],
+            kpi=kpi
+        )
+        for kpi in KPI_GROUPS
+    }
+else:
+    print("🧮 Computing KPI states from the full fact_rental_gold")
+    kpi_states = {kpi: partial_state(fact_rental_gold, kpi) for kpi in KPI_GROUPS}
 
-print("✅ gold_kpi_category created")
+# Means / variances are only derived here, at read time
+gold_kpi_category = finalize_state(kpi_states["category"], "category")
+gold_kpi_daily = finalize_state(kpi_states["daily"], "daily")
+
+print("✅ gold_kpi_category and gold_kpi_daily created")
 
 # ----------------------------
 # Save GOLD to MinIO
 # ----------------------------
 print("💾 Saving GOLD layer to MinIO...")
 
-fact_rental_gold.to_parquet(
-    f"s3://{GOLD_BUCKET}/fact_rental_gold.parquet",
-    filesystem=fs,
-    index=False
-)
 
-dim_time.to_parquet(
-    f"s3://{GOLD_BUCKET}/dim_time.parquet",
-    filesystem=fs,
-    index=False
-)
+def write_fact_partitions(fact, months):
+    """
+    Write one object per month partition, overwritten in place (readers see
+    the old or the new month, never a missing one). `months` lists the
+    partitions this run owns: those left without rows are removed.
+    """
+    written = set()
+    if len(fact):
+        for month, part in fact.groupby(month_of(fact["rental_date"]), sort=False):
+            write_parquet(part, f"{partition_path(GOLD_FACT_PATH, month)}part-0.parquet", filesystem=fs)
+            written.add(month)
+    for month in set(months) - written:
+        if fs.exists(partition_path(GOLD_FACT_PATH, month)):
+            fs.rm(partition_path(GOLD_FACT_PATH, month), recursive=True)
+    return written
 
-gold_kpi_category.to_parquet(
-    f"s3://{GOLD_BUCKET}/gold_kpi_category.parquet",
-    filesystem=fs,
-    index=False
-)
 
+if fold_increments:
+    write_fact_partitions(fact_rental_gold, months)
+    print(f"✅ fact_rental_gold: {len(months)} partition(s) rewritten")
+else:
+    written = write_fact_partitions(fact_rental_gold, [])
+    # Only once every partition is in place: stale months and the legacy file
+    if fs.exists(GOLD_FACT_PATH):
+        for path in fs.ls(GOLD_FACT_PATH, refresh=True):
+            name = path.rstrip("/").rsplit("/", 1)[-1]
+            if not (name.startswith(f"{PARTITION_COLUMN}=") and name.split("=", 1)[1] in written):
+                fs.rm(path, recursive=True)
+    if fs.exists(GOLD_FACT_LEGACY_PATH):
+        fs.rm(GOLD_FACT_LEGACY_PATH)
+    print(f"✅ fact_rental_gold: {len(written)} partition(s) written")
+
+if dim_time_changed:
+    write_parquet(dim_time, DIM_TIME_PATH, filesystem=fs)
+write_parquet(gold_kpi_category, f"s3://{GOLD_BUCKET}/gold_kpi_category.parquet", filesystem=fs)
+write_parquet(gold_kpi_daily, f"s3://{GOLD_BUCKET}/gold_kpi_daily.parquet", filesystem=fs)
+
+for kpi, kpi_state in kpi_states.items():
+    write_parquet(kpi_state, kpi_state_path(kpi), filesystem=fs)
+
+# Every change file present is now reflected in the states and the fact
+with fs.open(KPI_PROGRESS_PATH, "w") as f:
+    json.dump({"silver_rebuild": silver_rebuild, "folded": change_files}, f, indent=2)
+
+memory_report.print_report()
 print("🎉 GOLD layer successfully created and stored in MinIO!")
@@ -3,15 +3,29 @@ save_silver.py
 ---------------
 This script:
 1️⃣ Loads Bronze tables from MinIO
-2️⃣ Transforms them into a Silver layer (cleaned and enriched)
+2️⃣ Transforms them into a Silver layer (cleaned and enriched);
+   the rental fact is streamed chunk by chunk against in-memory dimensions
 3️⃣ Saves Silver tables locally (silver_save/)
 4️⃣ Uploads Silver tables to MinIO (bucket: silver)
+
+fact_rental is month-partitioned (fact_rental/month=YYYY-MM/). By default
+only rentals changed since the last run are merged in, rewriting just the
+partitions they fall in; SILVER_MODE=full rebuilds everything.
+
+Columns are written with the compact dtypes declared in dtype_plan.py.
 """
 
 import os
+import json
+import shutil
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import s3fs
 from dotenv import load_dotenv
+from bronze_dataset import PARTITION_COLUMN, PARTITIONING, bronze_dataset, read_bronze_table
+from dtype_plan import MemoryReport, apply_dtype_plan, parquet_schema, read_parquet, to_arrow, write_parquet
 
 # -------------------------------
 # Load environment variables
@@ -36,18 +50,101 @@ fs = s3fs.S3FileSystem(
 # -------------------------------
 os.makedirs("silver_save", exist_ok=True)
 
+# In-memory size of each Silver table, default dtypes vs dtype plan
+memory_report = MemoryReport()
+
 # -------------------------------
-# Load Bronze tables from MinIO
+# Bronze inputs of each transform
 # -------------------------------
-print("📥 Loading Bronze tables from MinIO...")
+# Only these tables are read, projected to these columns (None = all
+# columns). Declare new inputs here when a transform needs them.
+FILM_INPUTS = {
+    "film_category": ["film_id", "category_id"],
+    "category": ["category_id", "name"],
+    "film": [
+        "film_id", "title", "release_year", "rental_duration", "rental_rate",
+        "length", "replacement_cost", "rating", "special_features"
+    ],
+}
+
+# rental itself is streamed by rental_chunks() (all columns are carried
+# into the silver fact), only its dimensions are loaded here
+FACT_INPUTS = {
+    "inventory": ["inventory_id", "film_id", "store_id"],
+}
 
-tables = {}
+BRONZE_INPUTS = {**FILM_INPUTS, **FACT_INPUTS}
+
+# -------------------------------
+# Load Bronze tables from MinIO
+# -------------------------------
 bronze_path = "s3://bronze/dvdrental/"
+# Append files written by bronze_extract.py in incremental mode
+bronze_incremental_path = "s3://bronze/dvdrental_incremental/"
+
+# Primary keys used to keep only the latest version of a re-extracted row
+PRIMARY_KEYS = {
+    "film_actor": ["actor_id", "film_id"],
+    "film_category": ["film_id", "category_id"],
+}
+
+
+def list_increments(table_name):
+    increments_path = f"{bronze_incremental_path}{table_name}/"
+    if not fs.exists(increments_path):
+        return []
+    return [f for f in sorted(fs.ls(increments_path)) if f.endswith(".parquet")]
+
+
+def apply_increments(table_name, df, files, columns=None):
+    if not files:
+        return df
+
+    increments = [pd.read_parquet(f, filesystem=fs, columns=columns) for f in files]
+    keys = PRIMARY_KEYS.get(table_name, [f"{table_name}_id"])
+    merged = pd.concat([df, *increments], ignore_index=True)
+    merged = merged.sort_values("_ingestion_timestamp", kind="stable") \
+                   .drop_duplicates(subset=keys, keep="last") \
+                   .reset_index(drop=True)
+    print(f"🔁 Applied {len(increments)} increment file(s) to '{table_name}'")
+    return merged
+
+
+def load_bronze_table(table_name, columns=None):
+    """Read one bronze table (projected to `columns`) and apply its increments."""
+    files = list_increments(table_name)
+    read_columns = columns
+    if columns is not None and files:
+        # The merge needs the ingestion timestamp to pick the latest version
+        read_columns = list(dict.fromkeys([*columns, "_ingestion_timestamp"]))
+
+    df = read_bronze_table(fs, table_name, columns=read_columns, bronze_path=bronze_path)
+    df = apply_increments(table_name, df, files, read_columns)
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+class BronzeTables:
+    """Bronze tables loaded on first access, restricted to BRONZE_INPUTS."""
 
-for f in fs.ls(bronze_path):
-    table_name = f.split("/")[-1].replace(".parquet", "")
-    tables[table_name] = pd.read_parquet(f, filesystem=fs)
-    print(f"✅ Loaded '{table_name}' ({tables[table_name].shape[0]} rows)")
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.loaded = {}
+
+    def __getitem__(self, table_name):
+        if table_name not in self.inputs:
+            raise KeyError(f"❌ '{table_name}' is not declared in BRONZE_INPUTS")
+        if table_name not in self.loaded:
+            columns = self.inputs[table_name]
+            self.loaded[table_name] = load_bronze_table(table_name, columns)
+            projected = "all columns" if columns is None else f"{len(columns)} columns"
+            print(f"✅ Loaded '{table_name}' ({self.loaded[table_name].shape[0]} rows, {projected})")
+        return self.loaded[table_name]
+
+
+print("📥 Loading Bronze tables from MinIO (declared inputs only)...")
+tables = BronzeTables(BRONZE_INPUTS)
 
 # -------------------------------
 # Transform Film Table to Silver
@@ -66,52 +163,304 @@ def transform_to_silver(tables_dict):
     
     # Clean types
     df_silver['title'] = df_silver['title'].str.title()
-    df_silver['category'] = df_silver['category'].astype('category')
+    df_silver = apply_dtype_plan(df_silver, "dim_film", memory_report)
     
     return df_silver
 
-df_silver_film = transform_to_silver({
-    'film_category': tables['film_category'],
-    'category': tables['category'],
-    'film': tables['film']
-})
-
 # -------------------------------
-# Enrich Fact Table
+# Silver run mode
 # -------------------------------
-fact_rental = tables['rental'].merge(
-    tables['inventory'][['inventory_id', 'film_id', 'store_id']],
-    on='inventory_id',
-    how='left'
-)
+# incremental = only bronze rentals changed since the last silver run are
+#               upserted (by rental_id) into the month-partitioned fact
+# full        = rebuild fact_rental and dim_film from scratch
+SILVER_MODE = os.getenv("SILVER_MODE", "incremental")
 
-df_fact_silver = fact_rental.merge(
-    df_silver_film[['film_id', 'title', 'category', 'rental_rate', 'replacement_cost']],
-    on='film_id',
-    how='left'
-)
+if not fs.exists("silver"):
+    fs.mkdir("silver")
+
+FACT_SILVER_LOCAL = "silver_save/fact_rental/"
+FACT_SILVER_S3 = "s3://silver/fact_rental/"
+# Single-object layout written before the fact was month-partitioned
+FACT_SILVER_S3_LEGACY = "s3://silver/fact_rental.parquet"
+DIM_FILM_S3 = "s3://silver/dim_film.parquet"
+SILVER_STATE_PATH = "s3://silver/_state/silver_watermarks.json"
+# Change log of incremental runs: new versions (_sign=+1) and the versions
+# they replaced (_sign=-1), so Gold can fold KPIs without a rescan
+FACT_CHANGES_S3 = "s3://silver/_changes/fact_rental/"
+# State key recording when the fact was last fully rebuilt
+FULL_REBUILD_KEY = "_full_rebuild"
+
+# Bronze change-tracking column, and the dimensions a fact row depends on
+WATERMARK_COLUMN = "last_update"
+DIM_TABLES = ["film", "film_category", "category", "inventory"]
+
+# Rentals per streamed chunk (bounds the fact-side memory)
+SILVER_CHUNK_ROWS = int(os.getenv("SILVER_CHUNK_ROWS", "100000"))
+
+
+def load_silver_state():
+    """Bronze watermarks the current silver layer was built from."""
+    if not fs.exists(SILVER_STATE_PATH):
+        return {}
+    with fs.open(SILVER_STATE_PATH, "r") as f:
+        return {table: pd.Timestamp(mark) for table, mark in json.load(f).items()}
+
+
+def save_silver_state(state):
+    with fs.open(SILVER_STATE_PATH, "w") as f:
+        marks = {table: str(mark) for table, mark in state.items() if mark is not None}
+        json.dump(marks, f, indent=2, sort_keys=True)
+
+
+def latest(*marks):
+    marks = [m for m in marks if m is not None and pd.notna(m)]
+    return max(marks) if marks else None
+
+
+def source_watermark(table_name):
+    """Newest last_update of a bronze table, increments included."""
+    base = read_bronze_table(fs, table_name, columns=[WATERMARK_COLUMN], bronze_path=bronze_path)
+    increments = [
+        pd.read_parquet(f, filesystem=fs, columns=[WATERMARK_COLUMN])[WATERMARK_COLUMN].max()
+        for f in list_increments(table_name)
+    ]
+    return latest(base[WATERMARK_COLUMN].max(), *increments)
 
-# Calculate business metrics
-df_fact_silver['rental_yield'] = (df_fact_silver['rental_rate'] / df_fact_silver['replacement_cost']) * 100
-df_fact_silver['rental_date'] = pd.to_datetime(df_fact_silver['rental_date'])
-df_fact_silver['return_date'] = pd.to_datetime(df_fact_silver['return_date'])
-df_fact_silver['actual_rental_duration'] = (df_fact_silver['return_date'] - df_fact_silver['rental_date']).dt.days
+
+state = load_silver_state()
+dim_watermarks = {t: source_watermark(t) for t in DIM_TABLES}
+
+# Any dimension change re-enriches every rental: fall back to a full rebuild
+full_reason = None
+if SILVER_MODE == "full":
+    full_reason = "SILVER_MODE=full"
+elif "rental" not in state or not fs.exists(FACT_SILVER_S3):
+    full_reason = "no previous silver state"
+else:
+    changed_dims = [t for t in DIM_TABLES if latest(dim_watermarks[t]) != latest(state.get(t))]
+    if changed_dims:
+        full_reason = f"dimension(s) changed: {', '.join(changed_dims)}"
+
+if full_reason:
+    print(f"🧱 Full Silver rebuild ({full_reason})")
+    df_silver_film = transform_to_silver({
+        'film_category': tables['film_category'],
+        'category': tables['category'],
+        'film': tables['film']
+    })
+else:
+    print(f"🔁 Incremental Silver run (rentals updated after {state['rental']})")
+    # Dimensions unchanged: reuse the film dimension already in silver
+    df_silver_film = read_parquet(DIM_FILM_S3, filesystem=fs)
 
 # -------------------------------
-# Save Silver locally
+# Enrich Fact Table (streamed)
 # -------------------------------
-df_fact_silver.to_parquet("silver_save/fact_rental.parquet", index=False)
-df_silver_film.to_parquet("silver_save/dim_film.parquet", index=False)
-print("✅ Silver tables saved locally in 'silver_save/'")
+# Dimensions are small: loaded once and used as hash lookups keyed by id,
+# so each rental chunk is enriched with a broadcast join.
+inventory_lookup = tables['inventory'].drop_duplicates('inventory_id').set_index('inventory_id')
+film_lookup = df_silver_film[['film_id', 'title', 'category', 'rental_rate', 'replacement_cost']] \
+    .drop_duplicates('film_id') \
+    .set_index('film_id')
+
+
+def rental_chunks(since=None):
+    """
+    Bronze rental row groups as DataFrames, with increments applied.
+    With `since`, only rows whose last_update is newer are returned.
+    """
+    # Increment rows replace their base version and are emitted last
+    updates = apply_increments('rental', pd.DataFrame(), list_increments('rental'))
+    if since is not None and not updates.empty:
+        updates = updates[updates[WATERMARK_COLUMN] > since]
+
+    dataset = bronze_dataset(fs, 'rental', bronze_path)
+    columns = [c for c in dataset.schema.names if c != PARTITION_COLUMN]
+    row_filter = ds.field(WATERMARK_COLUMN) > since if since is not None else None
+    for batch in dataset.to_batches(columns=columns, filter=row_filter, batch_size=SILVER_CHUNK_ROWS):
+        chunk = batch.to_pandas()
+        if not updates.empty:
+            chunk = chunk[~chunk['rental_id'].isin(updates['rental_id'])]
+        if len(chunk):
+            yield chunk
+
+    if not updates.empty:
+        yield updates[columns]
+
+
+def enrich_chunk(chunk):
+    fact = chunk.merge(inventory_lookup, left_on='inventory_id', right_index=True, how='left')
+    fact = fact.merge(film_lookup, left_on='film_id', right_index=True, how='left')
+
+    # Calculate business metrics
+    fact['rental_yield'] = (fact['rental_rate'].astype('float64') / fact['replacement_cost'].astype('float64')) * 100
+    fact['rental_date'] = pd.to_datetime(fact['rental_date'])
+    fact['return_date'] = pd.to_datetime(fact['return_date'])
+    fact['actual_rental_duration'] = (fact['return_date'] - fact['rental_date']).dt.days
+    # The dtype plan also keeps the schema identical across chunks
+    return apply_dtype_plan(fact.reset_index(drop=True), "fact_rental", memory_report)
+
+
+def month_of(rental_date):
+    return rental_date.dt.strftime("%Y-%m").fillna("__HIVE_DEFAULT_PARTITION__")
+
+
+def partition_file(base, month):
+    return f"{base}{PARTITION_COLUMN}={month}/part-0.parquet"
+
+
+def upload_partition(month):
+    """
+    Replace one month partition in MinIO with the local copy. The object is
+    overwritten in place, so readers see the old or the new partition,
+    never a missing one; other files left in it are removed afterwards.
+    """
+    remote = partition_file(FACT_SILVER_S3, month)
+    fs.put_file(partition_file(FACT_SILVER_LOCAL, month), remote)
+    for path in fs.ls(f"{FACT_SILVER_S3}{PARTITION_COLUMN}={month}/", refresh=True):
+        if path != remote.replace("s3://", "", 1):
+            fs.rm(path, recursive=True)
+
+
+def remove_superseded_fact(months):
+    """After a rebuild: drop partitions it did not write, the legacy file and the change log."""
+    if fs.exists(FACT_SILVER_S3):
+        for path in fs.ls(FACT_SILVER_S3, refresh=True):
+            name = path.rstrip("/").rsplit("/", 1)[-1]
+            if not (name.startswith(f"{PARTITION_COLUMN}=") and name.split("=", 1)[1] in months):
+                fs.rm(path, recursive=True)
+    for path in (FACT_SILVER_S3_LEGACY, FACT_CHANGES_S3):
+        if fs.exists(path):
+            fs.rm(path, recursive=True)
+
+
+def rebuild_fact():
+    """
+    Stream every rental into fresh month partitions. Returns (rows,
+    watermark, months). Everything is written locally first; the previous
+    silver fact stays readable until all partitions are uploaded.
+    """
+    shutil.rmtree(FACT_SILVER_LOCAL, ignore_errors=True)
+
+    rows, watermark, schema = 0, None, None
+    writers = {}
+    for chunk in rental_chunks():
+        fact = enrich_chunk(chunk)
+        watermark = latest(watermark, fact[WATERMARK_COLUMN].max())
+        for month, part in fact.groupby(month_of(fact['rental_date']), sort=False):
+            table = to_arrow(part, schema)
+            if schema is None:
+                # The first chunk fixes the schema of every partition (int32
+                # dictionary indices: later chunks may carry more categories)
+                schema = table.schema
+            if month not in writers:
+                path = partition_file(FACT_SILVER_LOCAL, month)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writers[month] = pq.ParquetWriter(path, schema)
+            writers[month].write_table(table)
+            rows += table.num_rows
+
+    for writer in writers.values():
+        writer.close()
+    if not writers:
+        raise ValueError("❌ Bronze 'rental' is empty: no Silver fact_rental written")
+
+    for month in writers:
+        upload_partition(month)
+    # Only once every partition is in place
+    remove_superseded_fact(set(writers))
+    return rows, watermark, sorted(writers)
+
+
+def write_change_log(inserted, retracted):
+    log = pd.concat(
+        [retracted.assign(_sign=-1), inserted.assign(_sign=1)],
+        ignore_index=True
+    )
+    run_id = pd.Timestamp.now(tz="UTC").strftime("%Y%m%dT%H%M%S%f")
+    write_parquet(apply_dtype_plan(log), f"{FACT_CHANGES_S3}{run_id}.parquet", filesystem=fs)
+
+
+def merge_fact_changes(since):
+    """
+    Upsert rentals changed after `since` into the partitioned fact, keyed on
+    rental_id. Only the partitions holding old or new versions are rewritten.
+    Returns (rows, watermark, touched months, all months).
+    """
+    chunks = list(rental_chunks(since))
+    silver = ds.dataset(FACT_SILVER_S3.replace("s3://", "", 1).rstrip("/"),
+                        filesystem=fs, format="parquet", partitioning=PARTITIONING)
+    all_months = {
+        path.rsplit(f"{PARTITION_COLUMN}=", 1)[1]
+        for path in fs.ls(FACT_SILVER_S3) if f"{PARTITION_COLUMN}=" in path
+    }
+    if not chunks:
+        return 0, since, [], sorted(all_months)
+
+    changes = enrich_chunk(pd.concat(chunks, ignore_index=True))
+    changes_month = month_of(changes['rental_date'])
+    changed_ids = pa.array(changes['rental_id'].unique())
+
+    schema = parquet_schema(silver.schema)
+    schema = schema.remove(schema.get_field_index(PARTITION_COLUMN))
+
+    # Partitions holding the current version of a changed rental
+    previous = silver.to_table(
+        columns=['rental_id', PARTITION_COLUMN],
+        filter=ds.field('rental_id').isin(changed_ids),
+    ).to_pandas(ignore_metadata=True)
+    touched = sorted(set(changes_month) | set(previous[PARTITION_COLUMN].astype(str)))
+
+    retracted = []
+    for month in touched:
+        existing = apply_dtype_plan(
+            silver.to_table(filter=ds.field(PARTITION_COLUMN) == month)
+                  .drop([PARTITION_COLUMN])
+                  .to_pandas(ignore_metadata=True)
+        )
+        replaced = existing['rental_id'].isin(changes['rental_id'])
+        retracted.append(existing[replaced])
+        kept = existing[~replaced]
+        merged = pd.concat([kept, changes[changes_month == month]], ignore_index=True) \
+                   .sort_values('rental_id')
+        merged = apply_dtype_plan(merged)
+
+        path = partition_file(FACT_SILVER_LOCAL, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(to_arrow(merged, schema), path)
+        upload_partition(month)
+
+    write_change_log(changes, pd.concat(retracted, ignore_index=True))
+
+    watermark = latest(since, changes[WATERMARK_COLUMN].max())
+    return len(changes), watermark, touched, sorted(all_months | set(touched))
+
+
+if full_reason:
+    print("🏗️ Streaming rental chunks into Silver fact_rental...")
+    fact_rows, rental_watermark, touched = rebuild_fact()
+    all_months = touched
+else:
+    fact_rows, rental_watermark, touched, all_months = merge_fact_changes(state['rental'])
+
+skipped = len(all_months) - len(touched)
+print(f"✅ fact_rental: {fact_rows} rental(s) written, "
+      f"{len(touched)} partition(s) touched, {skipped} skipped")
 
 # -------------------------------
-# Save Silver in MinIO
+# Save Silver dimension
 # -------------------------------
-if not fs.exists("silver"):
-    fs.mkdir("silver")
+if full_reason:
+    write_parquet(df_silver_film, "silver_save/dim_film.parquet")
+    print("✅ Silver tables saved locally in 'silver_save/'")
+
+    write_parquet(df_silver_film, DIM_FILM_S3, filesystem=fs)
+    print("✅ Silver tables uploaded to MinIO bucket 'silver'")
+else:
+    print("⏭️ dim_film unchanged, not rewritten")
 
-df_fact_silver.to_parquet("s3://silver/fact_rental.parquet", filesystem=fs, index=False)
-df_silver_film.to_parquet("s3://silver/dim_film.parquet", filesystem=fs, index=False)
-print("✅ Silver tables uploaded to MinIO bucket 'silver'")
+full_rebuild = pd.Timestamp.now(tz="UTC") if full_reason else state.get(FULL_REBUILD_KEY)
+save_silver_state({"rental": rental_watermark, **dim_watermarks, FULL_REBUILD_KEY: full_rebuild})
+memory_report.print_report()
 
-print("🎉 Silver layer is ready for Gold layer creation!")
+print("🎉 Silver layer is ready for Gold layer creation!")
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+sink_pipeline.py
+----------------
+Fetch / sink / commit stages of the consumer's pipeline mode.
+
+The fetch loop (consumer_to_minio.run_pipeline_loop) hands every batch to
+one SinkWorker per sink (S3 archive, Postgres upsert), each with its own
+bounded queue, and registers the batch offsets with a CommitCoordinator.
+Offsets are only committed once every sink has acknowledged the batch,
+so a crash never commits a batch one of the sinks has not written.
+
+enqueue() is the backpressure point: a full sink queue pauses the Kafka
+partitions instead of buffering without bound.
+
+Nothing here imports Kafka: the coordinator hands back plain
+{TopicPartition: next offset} and the consumer wraps them for commit().
+"""
+
+import time
+import queue
+import threading
+
+
+# ======================================================
+# Sink stage
+# ======================================================
+
+class SinkWorker(threading.Thread):
+    """
+    One sink stage: takes batches from its own bounded queue, writes them
+    and acknowledges each batch sequence number to the coordinator.
+    Batches are processed in order, so acks are monotonic per sink.
+    """
+
+    def __init__(self, name, write_fn, coordinator, queue_size):
+        super().__init__(name=f"{name}-writer", daemon=True)
+        self.sink = name
+        self.write_fn = write_fn
+        self.coordinator = coordinator
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batches = 0
+        self.events = 0
+        self.busy_seconds = 0.0
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            seq, batch = item
+            started = time.perf_counter()
+            try:
+                self.write_fn(batch)
+            except Exception as e:
+                # Stop the stage; uncommitted offsets are redelivered on restart
+                self.error = e
+                break
+            self.busy_seconds += time.perf_counter() - started
+            self.batches += 1
+            self.events += len(batch)
+            self.coordinator.ack(self.sink, seq)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "batches": self.batches,
+            "events": self.events,
+            # events/s while actually writing = the sink's capacity
+            "events_per_s": self.events / self.busy_seconds if self.busy_seconds else 0.0,
+        }
+
+
+# ======================================================
+# Commit coordination
+# ======================================================
+
+class CommitCoordinator:
+    """
+    Tracks which batches each sink has durably written. The commit frontier
+    is the lowest sequence number acknowledged by every sink; offsets of all
+    batches up to it can be committed.
+    """
+
+    def __init__(self, sinks):
+        self.lock = threading.Lock()
+        self.acked = {sink: -1 for sink in sinks}
+        self.in_flight = {}     # seq -> {TopicPartition: last offset}
+        self.committed_seq = -1
+
+    def register(self, seq, offsets):
+        with self.lock:
+            self.in_flight[seq] = offsets
+
+    def ack(self, sink, seq):
+        with self.lock:
+            self.acked[sink] = seq
+
+    def ready_offsets(self):
+        """
+        {TopicPartition: next offset} that became safe to commit since the
+        last call (or None). Kafka commits the offset of the *next* message
+        to read, hence last offset + 1.
+        """
+        with self.lock:
+            frontier = min(self.acked.values())
+            if frontier <= self.committed_seq:
+                return None
+            offsets = {}
+            for seq in sorted(s for s in self.in_flight if s <= frontier):
+                for tp, offset in self.in_flight.pop(seq).items():
+                    offsets[tp] = max(offset, offsets.get(tp, -1))
+            self.committed_seq = frontier
+        return {tp: offset + 1 for tp, offset in offsets.items()}
+
+    def pending(self):
+        with self.lock:
+            return len(self.in_flight)
+
+    def frontier(self):
+        """Highest sequence number written by every sink."""
+        with self.lock:
+            return min(self.acked.values())
+
+
+# ======================================================
+# Backpressure
+# ======================================================
+
+def enqueue(consumer, worker, item, undelivered, poll=True):
+    """
+    Put with backpressure: while the sink queue is full the fetch stage
+    pauses its partitions and keeps calling poll(0). The heartbeat thread
+    alone is not enough: a member that stops polling for longer than
+    max_poll_interval_ms is evicted from the group, however alive its
+    heartbeat. poll=False (inside a rebalance callback) just blocks.
+
+    `undelivered` maps sink -> item not yet queued; a rebalance triggered by
+    poll(0) may deliver it from drain(), in which case it is not put twice.
+    Returns the records poll(0) delivered (partitions newly assigned by a
+    rebalance are not paused yet); the caller buffers them.
+    """
+    received = []
+    paused = False
+    while worker.sink in undelivered:
+        try:
+            worker.queue.put(item, timeout=0.5)
+            undelivered.pop(worker.sink, None)
+        except queue.Full:
+            if worker.error is not None:
+                raise RuntimeError(f"{worker.sink} sink failed: {worker.error}")
+            if poll:
+                # Re-paused each time: a rebalance may have assigned new partitions
+                consumer.pause(*consumer.assignment())
+                paused = True
+                for messages in consumer.poll(timeout_ms=0).values():
+                    received.extend(messages)
+    if paused:
+        consumer.resume(*consumer.paused())
+    return received
@@ -13,6 +13,10 @@ FROM fact_rental_gold
 GROUP BY category;
 
 --Revenu mensuel (time series)
+--Jointure sur la clé entière date_key (YYYYMMDD) : sargable, utilise les index
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_time_date_key ON dim_time(date_key);
+CREATE INDEX IF NOT EXISTS idx_fact_rental_gold_date_key ON fact_rental_gold(date_key);
 
 DROP MATERIALIZED VIEW IF EXISTS mv_revenue_monthly;
 
@@ -24,7 +28,7 @@ SELECT
     SUM(fr.rental_rate) AS total_revenue
 FROM fact_rental_gold fr
 JOIN dim_time dt
-    ON fr.rental_date::date = dt.date
+    ON fr.date_key = dt.date_key
 GROUP BY dt.year, dt.month;
 
 
@@ -52,6 +56,7 @@ DROP MATERIALIZED VIEW IF EXISTS mv_kpi_global;
 
 CREATE MATERIALIZED VIEW mv_kpi_global AS
 SELECT
+    1                                AS kpi_id,   -- clé de l'index unique (REFRESH CONCURRENTLY)
     COUNT(DISTINCT rental_id)        AS total_rentals,
     COUNT(DISTINCT customer_id)      AS total_customers,
     COUNT(DISTINCT film_id)          AS total_films,
@@ -66,3 +71,84 @@ CREATE INDEX idx_mv_category ON mv_revenue_by_category(category);
 CREATE INDEX idx_mv_monthly_year_month ON mv_revenue_monthly(year, month);
 CREATE INDEX idx_mv_top_films_revenue ON mv_top_films(total_revenue);
 
+--index uniques requis par REFRESH MATERIALIZED VIEW CONCURRENTLY (refresh_gold_views.py)
+
+CREATE UNIQUE INDEX ux_mv_revenue_by_category ON mv_revenue_by_category(category);
+CREATE UNIQUE INDEX ux_mv_revenue_monthly ON mv_revenue_monthly(year, month);
+CREATE UNIQUE INDEX ux_mv_top_films ON mv_top_films(title, category);
+CREATE UNIQUE INDEX ux_mv_kpi_global ON mv_kpi_global(kpi_id);
+
+--KPI à partir des états partiels (count, sum, sumsq, min, max)
+--Moyennes et variances calculées à la lecture : les états restent additionnables
+--(chargés depuis Gold, puis enrichis batch par batch par le consumer Kafka)
+
+CREATE OR REPLACE VIEW v_kpi_category AS
+SELECT
+    category,
+    n_rentals AS total_rentals,
+    rental_rate_sum / NULLIF(rental_rate_count, 0) AS avg_rental_rate,
+    GREATEST((rental_rate_sumsq - rental_rate_sum * rental_rate_sum / NULLIF(rental_rate_count, 0)) / NULLIF(rental_rate_count - 1, 0), 0) AS var_rental_rate,
+    rental_rate_min AS min_rental_rate,
+    rental_rate_max AS max_rental_rate,
+    length_sum / NULLIF(length_count, 0) AS avg_film_length,
+    GREATEST((length_sumsq - length_sum * length_sum / NULLIF(length_count, 0)) / NULLIF(length_count - 1, 0), 0) AS var_film_length,
+    length_min AS min_film_length,
+    length_max AS max_film_length,
+    replacement_cost_sum / NULLIF(replacement_cost_count, 0) AS avg_replacement_cost,
+    GREATEST((replacement_cost_sumsq - replacement_cost_sum * replacement_cost_sum / NULLIF(replacement_cost_count, 0)) / NULLIF(replacement_cost_count - 1, 0), 0) AS var_replacement_cost,
+    replacement_cost_min AS min_replacement_cost,
+    replacement_cost_max AS max_replacement_cost,
+    actual_rental_duration_sum / NULLIF(actual_rental_duration_count, 0) AS avg_rental_duration,
+    GREATEST((actual_rental_duration_sumsq - actual_rental_duration_sum * actual_rental_duration_sum / NULLIF(actual_rental_duration_count, 0)) / NULLIF(actual_rental_duration_count - 1, 0), 0) AS var_rental_duration,
+    actual_rental_duration_min AS min_rental_duration,
+    actual_rental_duration_max AS max_rental_duration,
+    rental_rate_sum AS total_revenue
+FROM gold_kpi_category_state;
+
+CREATE OR REPLACE VIEW v_kpi_daily AS
+SELECT
+    date_key,
+    n_rentals AS total_rentals,
+    rental_rate_sum / NULLIF(rental_rate_count, 0) AS avg_rental_rate,
+    GREATEST((rental_rate_sumsq - rental_rate_sum * rental_rate_sum / NULLIF(rental_rate_count, 0)) / NULLIF(rental_rate_count - 1, 0), 0) AS var_rental_rate,
+    rental_rate_min AS min_rental_rate,
+    rental_rate_max AS max_rental_rate,
+    length_sum / NULLIF(length_count, 0) AS avg_film_length,
+    GREATEST((length_sumsq - length_sum * length_sum / NULLIF(length_count, 0)) / NULLIF(length_count - 1, 0), 0) AS var_film_length,
+    length_min AS min_film_length,
+    length_max AS max_film_length,
+    replacement_cost_sum / NULLIF(replacement_cost_count, 0) AS avg_replacement_cost,
+    GREATEST((replacement_cost_sumsq - replacement_cost_sum * replacement_cost_sum / NULLIF(replacement_cost_count, 0)) / NULLIF(replacement_cost_count - 1, 0), 0) AS var_replacement_cost,
+    replacement_cost_min AS min_replacement_cost,
+    replacement_cost_max AS max_replacement_cost,
+    actual_rental_duration_sum / NULLIF(actual_rental_duration_count, 0) AS avg_rental_duration,
+    GREATEST((actual_rental_duration_sumsq - actual_rental_duration_sum * actual_rental_duration_sum / NULLIF(actual_rental_duration_count, 0)) / NULLIF(actual_rental_duration_count - 1, 0), 0) AS var_rental_duration,
+    actual_rental_duration_min AS min_rental_duration,
+    actual_rental_duration_max AS max_rental_duration,
+    rental_rate_sum AS total_revenue
+FROM gold_kpi_daily_state;
+
+--Résumés temps réel maintenus par le consumer Kafka (delta INSERT ... ON CONFLICT par batch)
+--Lecture en O(groupes) : à utiliser à la place de fact_rental_gold / mv_* pour les chiffres live
+
+CREATE OR REPLACE VIEW v_kpi_title AS
+SELECT
+    title,
+    category,
+    n_rentals AS total_rentals,
+    rental_rate_sum AS total_revenue
+FROM gold_kpi_title_state
+WHERE n_rentals > 0;
+
+--Équivalent live de mv_kpi_global (films comptés par titre distinct : l'état titre est
+--clé (title, category), un titre vu avec une catégorie 'Unknown' y a deux lignes ; clients par customer_id)
+
+CREATE OR REPLACE VIEW v_kpi_global AS
+SELECT
+    g.kpi_id,
+    g.n_rentals AS total_rentals,
+    (SELECT COUNT(*) FROM gold_kpi_customer_state WHERE n_rentals > 0) AS total_customers,
+    (SELECT COUNT(DISTINCT title) FROM gold_kpi_title_state WHERE n_rentals > 0 AND title <> 'Unknown') AS total_films,
+    g.rental_rate_sum AS total_revenue,
+    g.actual_rental_duration_sum / NULLIF(g.actual_rental_duration_count, 0) AS avg_rental_duration
+FROM gold_kpi_global_state g;
@@ -1,4 +1,5 @@
-REFRESH MATERIALIZED VIEW mv_revenue_by_category;
-REFRESH MATERIALIZED VIEW mv_revenue_monthly;
-REFRESH MATERIALIZED VIEW mv_top_films;
-REFRESH MATERIALIZED VIEW mv_kpi_global;
+-- Refresh manuel ; refresh_gold_views.py fait la même chose en parallèle et saute les vues inchangées
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_revenue_by_category;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_revenue_monthly;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_top_films;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_kpi_global;
@@ -0,0 +1,242 @@
+"""
+live_cache.py
+-------------
+Incremental cache behind the live dashboard.
+
+Instead of re-reading Postgres on every refresh, LiveAggregates keeps
+running aggregates (revenue and rentals per day, category, title and
+category x rating) in memory and only fetches the fact rows inserted
+since the last refresh, using the `ingested_at` column the Kafka
+consumer stamps on every new row. Refresh cost follows the arrival rate,
+not the table size.
+
+- seed: the aggregates are read once from the KPI state views the Kafka
+  consumer keeps up to date (v_kpi_daily, v_kpi_category, v_kpi_title:
+  O(groups) rows); only category x rating, which has no state table, is a
+  GROUP BY over the fact (as is everything when the views are missing).
+  Seed and the detail rows of the retention window share one REPEATABLE
+  READ snapshot whose start time becomes the watermark.
+- refresh: rows with ingested_at after the watermark (minus a small
+  overlap, for transactions that committed late) are fetched; those
+  already held in the detail window are skipped, the others are folded
+  into the aggregates.
+- retention: detail rows older than LIVE_RETENTION_MINUTES are evicted;
+  they are only kept to de-duplicate the overlap.
+
+Updates to rentals already counted are not refolded (only inserts bump
+ingested_at): the cache re-seeds every LIVE_RESEED_MINUTES, and at once
+when fact_rental_gold is replaced by a Gold reload or lacks ingested_at.
+
+Usage (one instance per Streamlit process):
+    @st.cache_resource
+    def get_live_aggregates():
+        return LiveAggregates(engine)
+    live = get_live_aggregates().refresh(max_age=5)
+"""
+
+import os
+import threading
+import time
+import pandas as pd
+
+from pg_copy_reader import read_sql_pandas
+from kpi_state import UNKNOWN_KEY
+
+FACT_TABLE = "fact_rental_gold"
+INGESTED_COLUMN = "ingested_at"
+
+LIVE_RETENTION_MINUTES = int(os.getenv("LIVE_RETENTION_MINUTES", "30"))
+LIVE_OVERLAP_SECONDS = int(os.getenv("LIVE_OVERLAP_SECONDS", "30"))
+LIVE_RESEED_MINUTES = int(os.getenv("LIVE_RESEED_MINUTES", "15"))
+
+# Aggregate name -> group key columns (computed ones mapped in KEY_EXPRESSIONS)
+AGGREGATES = {
+    "daily": ["day"],
+    "category": ["category"],
+    "title": ["title"],
+    "category_rating": ["category", "rating"],
+}
+KEY_EXPRESSIONS = {"day": "rental_date::date AS day"}
+
+# Seeds read from the KPI state views (same snapshot as the fact). The
+# states label NULL keys 'Unknown'; mapped back to NULL like the fact rows
+STATE_SEEDS = {
+    "daily": """
+        SELECT to_date(date_key::text, 'YYYYMMDD') AS day,
+               total_revenue::float8 AS revenue, total_rentals AS rentals
+        FROM v_kpi_daily WHERE total_rentals > 0
+    """,
+    "category": f"""
+        SELECT NULLIF(category, '{UNKNOWN_KEY}') AS category,
+               total_revenue::float8 AS revenue, total_rentals AS rentals
+        FROM v_kpi_category WHERE total_rentals > 0
+    """,
+    "title": f"""
+        SELECT NULLIF(title, '{UNKNOWN_KEY}') AS title,
+               SUM(total_revenue)::float8 AS revenue, SUM(total_rentals)::bigint AS rentals
+        FROM v_kpi_title GROUP BY 1
+    """,
+}
+STATE_VIEWS = ["v_kpi_daily", "v_kpi_category", "v_kpi_title"]
+
+# Fact columns needed to fold a row into every aggregate
+DETAIL_SELECT = (
+    f"rental_id, rental_date::date AS day, category, title, rating, "
+    f"rental_rate::float8 AS rental_rate, {INGESTED_COLUMN}"
+)
+
+
+class LiveAggregates:
+    """Running aggregates of fact_rental_gold, refreshed by delta fetches."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.aggregates = {}
+        self.detail = pd.DataFrame()
+        self.watermark = None
+        self.table_oid = None
+        self.incremental = False
+        self.seeded_at = 0.0
+        self.refreshed_at = 0.0
+        self.last_fetched = 0
+
+    # -------- Postgres --------
+    def _query(self, sql, params=None):
+        return read_sql_pandas(sql, self.engine, params)
+
+    def _table_info(self):
+        """(oid of the fact table, whether it has ingested_at)."""
+        info = self._query(
+            """
+            SELECT c.oid::bigint AS oid,
+                   EXISTS (SELECT 1 FROM pg_attribute a
+                           WHERE a.attrelid = c.oid AND a.attname = %(column)s
+                             AND NOT a.attisdropped) AS incremental
+            FROM pg_class c
+            WHERE c.oid = to_regclass(%(table)s)
+            """,
+            {"table": FACT_TABLE, "column": INGESTED_COLUMN}
+        )
+        if info.empty:
+            return None, False
+        return int(info["oid"].iloc[0]), bool(info["incremental"].iloc[0])
+
+    # -------- Seed --------
+    def _seed(self, oid, incremental):
+        # One snapshot for everything: rows it can't see yet (committed later,
+        # possibly with an earlier ingested_at) come through the overlap fetch
+        with self.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+            watermark = pd.Timestamp(pd.read_sql("SELECT now() AS ts", conn)["ts"].iloc[0]).tz_convert("UTC")
+            states = bool(pd.read_sql(
+                "SELECT bool_and(to_regclass(v) IS NOT NULL) AS ok FROM unnest(%(views)s) AS v",
+                conn,
+                params={"views": STATE_VIEWS}
+            )["ok"].iloc[0])
+            aggregates = {}
+            for name, keys in AGGREGATES.items():
+                if states and name in STATE_SEEDS:
+                    aggregates[name] = pd.read_sql(STATE_SEEDS[name], conn)
+                    continue
+                columns = ", ".join(KEY_EXPRESSIONS.get(k, k) for k in keys)
+                aggregates[name] = pd.read_sql(
+                    f"""
+                    SELECT {columns},
+                           COALESCE(SUM(rental_rate), 0)::float8 AS revenue,
+                           COUNT(*) AS rentals
+                    FROM {FACT_TABLE}
+                    GROUP BY {", ".join(str(i + 1) for i in range(len(keys)))}
+                    """,
+                    conn
+                )
+            detail = pd.DataFrame()
+            if incremental:
+                detail = pd.read_sql(
+                    f"SELECT {DETAIL_SELECT} FROM {FACT_TABLE} WHERE {INGESTED_COLUMN} > %(since)s",
+                    conn,
+                    params={"since": watermark - pd.Timedelta(minutes=self._retention_minutes())}
+                )
+                detail[INGESTED_COLUMN] = pd.to_datetime(detail[INGESTED_COLUMN], utc=True)
+
+        self.aggregates = aggregates
+        self.detail = detail
+        self.watermark = watermark
+        self.table_oid = oid
+        self.incremental = incremental
+        self.seeded_at = time.time()
+
+    @staticmethod
+    def _retention_minutes():
+        # The detail window must at least cover the overlap it de-duplicates
+        return max(LIVE_RETENTION_MINUTES, LIVE_OVERLAP_SECONDS / 60)
+
+    # -------- Delta --------
+    def _fold(self, rows):
+        for name, keys in AGGREGATES.items():
+            delta = (
+                rows.groupby(keys, dropna=False, sort=False)
+                .agg(revenue=("rental_rate", "sum"), rentals=("rental_id", "count"))
+                .reset_index()
+            )
+            self.aggregates[name] = (
+                pd.concat([self.aggregates[name], delta], ignore_index=True)
+                .groupby(keys, dropna=False, sort=False)[["revenue", "rentals"]].sum()
+                .reset_index()
+            )
+
+    def _fetch_delta(self):
+        rows = self._query(
+            f"SELECT {DETAIL_SELECT} FROM {FACT_TABLE} WHERE {INGESTED_COLUMN} > %(since)s",
+            {"since": self.watermark - pd.Timedelta(seconds=LIVE_OVERLAP_SECONDS)}
+        )
+        rows[INGESTED_COLUMN] = pd.to_datetime(rows[INGESTED_COLUMN], utc=True)
+        self.last_fetched = len(rows)
+        if len(self.detail):
+            rows = rows[~rows["rental_id"].isin(self.detail["rental_id"])]
+        if len(rows):
+            self._fold(rows)
+            self.detail = pd.concat([self.detail, rows], ignore_index=True)
+            self.watermark = max(self.watermark, rows[INGESTED_COLUMN].max())
+
+        # Bounded retention: old detail rows are no longer needed for de-duplication
+        if len(self.detail):
+            horizon = self.watermark - pd.Timedelta(minutes=self._retention_minutes())
+            self.detail = self.detail[self.detail[INGESTED_COLUMN] > horizon].reset_index(drop=True)
+
+    # -------- Public --------
+    def refresh(self, max_age=0):
+        """
+        Bring the aggregates up to date (delta fetch, or a full re-seed when
+        needed). Within `max_age` seconds of the last refresh nothing is
+        queried, so concurrent sessions share one fetch per period.
+        """
+        with self.lock:
+            if self.aggregates and time.time() - self.refreshed_at < max_age:
+                return self
+            oid, incremental = self._table_info()
+            reseed = (
+                not self.aggregates
+                or not incremental
+                or oid != self.table_oid
+                or time.time() - self.seeded_at > LIVE_RESEED_MINUTES * 60
+            )
+            if reseed:
+                self._seed(oid, incremental)
+                self.last_fetched = None
+            else:
+                self._fetch_delta()
+            self.refreshed_at = time.time()
+        return self
+
+    def get(self, name):
+        """Copy of one aggregate (columns: its keys, revenue, rentals)."""
+        with self.lock:
+            return self.aggregates[name].copy()
+
+    def stats(self):
+        return {
+            "incremental": self.incremental,
+            "detail_rows": len(self.detail),
+            "last_fetched": self.last_fetched,
+            "watermark": self.watermark,
+        }
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from dtype_plan import apply_dtype_plan, read_parquet, to_arrow, write_parquet
+
+
+def film_frame(titles):
+    return apply_dtype_plan(pd.DataFrame({
+        "film_id": range(1, len(titles) + 1),
+        "title": titles,
+        "rental_rate": [0.99] * len(titles),
+        "special_features": ['{Trailers,"Deleted Scenes"}'] + [None] * (len(titles) - 1),
+    }))
+
+
+def test_parquet_round_trip_keeps_planned_dtypes(tmp_path):
+    df = film_frame(["ACADEMY DINOSAUR", "ACE GOLDFINGER"])
+    path = str(tmp_path / "dim_film.parquet")
+
+    write_parquet(df, path)
+    back = read_parquet(path)
+
+    assert back.dtypes.equals(df.dtypes)
+    assert back.equals(df)
+
+
+def test_read_parquet_ignores_pandas_metadata_of_older_files(tmp_path):
+    # Files written by DataFrame.to_parquet name the list dtype in their
+    # pandas metadata, which pd.read_parquet can't parse back
+    df = film_frame(["ACADEMY DINOSAUR", "ACE GOLDFINGER"])
+    path = str(tmp_path / "dim_film.parquet")
+    df.to_parquet(path, index=False)
+
+    assert read_parquet(path).equals(df)
+
+
+def test_later_chunks_may_have_more_categories(tmp_path):
+    first = film_frame(["A", "B"])
+    later = film_frame([f"TITLE {i}" for i in range(300)])
+    path = str(tmp_path / "part-0.parquet")
+
+    table = to_arrow(first)
+    with pq.ParquetWriter(path, table.schema) as writer:
+        writer.write_table(table)
+        writer.write_table(to_arrow(later, table.schema))
+
+    assert len(read_parquet(path)) == 302
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from kpi_state import (SIGN_COLUMN, UNKNOWN_KEY, finalize_state, fold_sql,
+                       lock_keys_sql, merge_states, partial_state)
+
+
+def rentals(rows):
+    return pd.DataFrame(rows, columns=["rental_id", "category", "rental_rate", "length"])
+
+
+def signed(df, sign):
+    return df.assign(**{SIGN_COLUMN: sign})
+
+
+def test_retraction_then_new_version_matches_a_rebuild():
+    old = rentals([(1, "Action", 2.99, 100), (2, "Action", 0.99, 80), (3, "Drama", 4.99, None)])
+    # rental 2 is updated (rate and category change), rental 4 is new
+    new_versions = rentals([(2, "Drama", 1.99, 80), (4, "Action", 0.99, 120)])
+    current = rentals([(1, "Action", 2.99, 100), (2, "Drama", 1.99, 80),
+                       (3, "Drama", 4.99, None), (4, "Action", 0.99, 120)])
+
+    delta = pd.concat([signed(new_versions, 1), signed(old[old["rental_id"] == 2], -1)])
+    folded = merge_states(partial_state(old, "category"), partial_state(delta, "category"), kpi="category")
+    rebuilt = partial_state(current, "category")
+
+    exact = [c for c in rebuilt.columns if not c.endswith(("_min", "_max"))]
+    pd.testing.assert_frame_equal(folded[exact], rebuilt[exact])
+
+
+def test_replayed_batch_nets_out():
+    old = rentals([(1, "Action", 2.99, 100)])
+    delta = pd.concat([signed(old, 1), signed(old, -1)])
+    folded = merge_states(partial_state(old, "category"), partial_state(delta, "category"), kpi="category")
+
+    pd.testing.assert_frame_equal(folded, partial_state(old, "category"))
+
+
+def test_min_max_are_only_widened_by_retractions():
+    old = rentals([(1, "Action", 0.99, 100), (2, "Action", 4.99, 100)])
+    delta = signed(old[old["rental_id"] == 2], -1)
+    folded = merge_states(partial_state(old, "category"), partial_state(delta, "category"), kpi="category")
+
+    assert folded.loc[0, "rental_rate_max"] == 4.99
+    assert folded.loc[0, "n_rentals"] == 1
+
+
+def test_finalize_state_means_and_sample_variance():
+    df = rentals([(1, "Action", 1.0, None), (2, "Action", 3.0, None), (3, None, 2.0, 90)])
+    out = finalize_state(partial_state(df, "category"), "category").set_index("category")
+
+    assert out.loc["Action", "avg_rental_rate"] == 2.0
+    assert out.loc["Action", "var_rental_rate"] == 2.0
+    assert np.isnan(out.loc["Action", "avg_film_length"])
+    # Null labels are kept as their own group
+    assert out.loc[UNKNOWN_KEY, "total_rentals"] == 1
+
+
+def test_fold_and_lock_take_keys_in_order():
+    assert "ORDER BY 1, 2" in fold_sql("title")
+    assert "ORDER BY rental_id" in lock_keys_sql("_stage", "fact_rental_gold")
@@ -0,0 +1,140 @@
+import os
+import sys
+from collections import namedtuple
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import pg_copy_reader
+from pg_copy_reader import read_sql_arrow, read_sql_pandas
+
+Column = namedtuple("Column", "name type_code precision scale")
+
+
+class FakeCursor:
+    """psycopg2 cursor answering the reader's catalog queries and one COPY."""
+
+    def __init__(self, columns, csv, categories=None):
+        self.columns = columns
+        self.csv = csv
+        self.categories = categories or {}
+        self.description = None
+        self.rows = []
+
+    def mogrify(self, sql, params):
+        return (sql % {k: repr(v) for k, v in params.items()}).encode("utf-8")
+
+    def execute(self, sql, params=None):
+        if "LIMIT 0" in sql:
+            self.description = self.columns
+        elif "typcategory" in sql:
+            self.rows = [(oid, self.categories[oid]) for oid in params[0]]
+
+    def fetchall(self):
+        return self.rows
+
+    def copy_expert(self, sql, buffer):
+        buffer.write(self.csv.encode("utf-8"))
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeEngine:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def raw_connection(self):
+        return FakeConnection(self._cursor)
+
+
+def fallback_recorder(monkeypatch, frame):
+    calls = []
+
+    def read_sql(sql, engine, params=None):
+        calls.append(sql)
+        return frame
+
+    monkeypatch.setattr(pg_copy_reader.pd, "read_sql", read_sql)
+    return calls
+
+
+def test_copy_csv_is_decoded_with_the_catalog_types(monkeypatch):
+    columns = [
+        Column("rental_id", 23, None, None),
+        Column("amount", 1700, 5, 2),
+        Column("ratio", 1700, None, None),
+        Column("paid_at", 1184, None, None),
+        Column("active", 16, None, None),
+        Column("note", 25, None, None),
+        Column("day", 1082, None, None),
+        Column("rating", 99999, None, None),
+    ]
+    csv = (
+        "rental_id,amount,ratio,paid_at,active,note,day,rating\n"
+        '1,2.99,0.5,2005-05-24 22:53:30+00,t,"",2005-05-24,PG-13\n'
+        "2,,,,f,,,\n"
+    )
+    engine = FakeEngine(FakeCursor(columns, csv, categories={99999: "E"}))
+    calls = fallback_recorder(monkeypatch, None)
+
+    table = read_sql_arrow("SELECT * FROM payment", engine)
+
+    assert calls == []
+    assert table.schema.types == [
+        pa.int32(), pa.decimal128(5, 2), pa.float64(), pa.timestamp("us", tz="UTC"),
+        pa.bool_(), pa.string(), pa.date32(), pa.string(),
+    ]
+    assert table.column("amount").to_pylist() == [Decimal("2.99"), None]
+    assert table.column("active").to_pylist() == [True, False]
+    # Quoted empty string stays a string, unquoted empty field is NULL
+    assert table.column("note").to_pylist() == ["", None]
+    assert table.column("rating").to_pylist() == ["PG-13", None]
+
+
+def test_unparseable_copy_output_falls_back_to_read_sql(monkeypatch):
+    columns = [Column("rental_id", 23, None, None), Column("return_date", 1114, None, None)]
+    csv = "rental_id,return_date\n1,infinity\n"
+    engine = FakeEngine(FakeCursor(columns, csv))
+    expected = pd.DataFrame({"rental_id": [1], "return_date": ["infinity"]})
+    calls = fallback_recorder(monkeypatch, expected)
+
+    df = read_sql_pandas("SELECT rental_id, return_date FROM rental", engine)
+
+    assert calls == ["SELECT rental_id, return_date FROM rental"]
+    assert df is expected
+
+
+def test_unsupported_types_and_statements_use_read_sql(monkeypatch):
+    expected = pd.DataFrame({"x": [1]})
+    calls = fallback_recorder(monkeypatch, expected)
+
+    # Array column (typcategory 'A') can't be decoded from CSV
+    engine = FakeEngine(FakeCursor([Column("special_features", 1009, None, None)], "", categories={1009: "A"}))
+    assert read_sql_pandas("SELECT special_features FROM film", engine) is expected
+    # Only SELECT-like statements are copied
+    assert read_sql_pandas("SHOW server_version", engine) is expected
+    assert len(calls) == 2
+
+
+def test_params_are_bound_before_copy(monkeypatch):
+    cursor = FakeCursor([Column("n", 20, None, None)], "n\n7\n")
+    calls = fallback_recorder(monkeypatch, None)
+
+    df = read_sql_pandas("SELECT count(*) AS n FROM payment WHERE amount > %(x)s", FakeEngine(cursor), {"x": 5})
+
+    assert calls == []
+    assert df["n"].tolist() == [7]
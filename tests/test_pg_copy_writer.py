@@ -0,0 +1,56 @@
+import os
+import sys
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from pg_copy_writer import pg_type, to_copy_csv, to_pg_text_array
+
+
+def copy_lines(**columns):
+    return to_copy_csv(pa.RecordBatch.from_pydict(columns)).read().decode("utf-8").splitlines()
+
+
+def test_pg_types_follow_the_arrow_schema():
+    assert pg_type(pa.int16()) == "smallint"
+    assert pg_type(pa.int32()) == "integer"
+    assert pg_type(pa.int64()) == "bigint"
+    assert pg_type(pa.decimal128(4, 2)) == "numeric(4, 2)"
+    assert pg_type(pa.timestamp("us", tz="UTC")) == "timestamptz"
+    assert pg_type(pa.dictionary(pa.int8(), pa.string())) == "text"
+    assert pg_type(pa.list_(pa.string())) == "text[]"
+    assert pg_type(pa.list_(pa.int64())) == "jsonb"
+
+
+def test_string_lists_become_escaped_array_literals():
+    column = pa.array([["Trailers", "Deleted Scenes"], None, ['say "hi"', None, "a\\b"], []],
+                      type=pa.list_(pa.string()))
+
+    assert to_pg_text_array(column).to_pylist() == [
+        '{"Trailers","Deleted Scenes"}', None, '{"say \\"hi\\"",NULL,"a\\\\b"}', "{}",
+    ]
+
+
+def test_sliced_string_lists_with_nulls():
+    column = pa.array([["a"], None, ["b", None], ["c"], None, ["d"]], type=pa.list_(pa.string()))
+
+    assert to_pg_text_array(column.slice(1, 4)).to_pylist() == [None, '{"b",NULL}', '{"c"}', None]
+    large = column.cast(pa.large_list(pa.string())).slice(2, 2)
+    assert to_pg_text_array(large).to_pylist() == ['{"b",NULL}', '{"c"}']
+
+
+def test_decimal_and_nullable_int_columns_in_copy_csv():
+    amounts = pa.array([Decimal("2.99"), None, Decimal("10.00")], type=pa.decimal128(5, 2))
+    # pandas nullable Int64 (as written by the dtype plan) -> int64 with nulls
+    staff = pa.Array.from_pandas(pd.array([1, None, 2], dtype="Int64"))
+
+    assert staff.type == pa.int64()
+    assert copy_lines(amount=amounts, staff_id=staff) == ["2.99,1", ",", "10.00,2"]
+
+
+def test_copy_csv_keeps_empty_strings_apart_from_nulls():
+    features = pa.array([["Trailers"], None], type=pa.list_(pa.string())).slice(0, 2)
+
+    assert copy_lines(title=["", None], special_features=features) == ['"","{""Trailers""}"', ',']
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+
+import pyarrow as pa
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from rental_codec import HEADER, MAGIC_BYTE, LocalSchemaRegistry, RentalCodec
+
+RENTAL = {
+    "rental_id": 16050,
+    "customer_id": 130,
+    "film_id": 80,
+    "inventory_id": 367,
+    "staff_id": 1,
+    "title": "Blanket Beverly",
+    "category": "Family",
+    "rental_rate": 2.99,
+    "rental_date": "2005-05-24 22:53:30",
+    "actual_rental_duration": 5,
+    "_produced_at": 1716590010000,
+}
+
+
+def write_schema(schema_dir, schema_id, fields):
+    subject_dir = schema_dir / "dvd_rentals"
+    subject_dir.mkdir(parents=True, exist_ok=True)
+    schema = {"subject": "dvd_rentals", "id": schema_id,
+              "fields": [{"name": name, "type": type_} for name, type_ in fields]}
+    (subject_dir / f"{schema_id}.json").write_text(json.dumps(schema))
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack"])
+def test_round_trip(codec):
+    rental_codec = RentalCodec(codec)
+
+    assert rental_codec.decode(rental_codec.encode(RENTAL)) == RENTAL
+
+
+def test_msgpack_payload_is_framed_with_the_latest_schema_id(tmp_path):
+    write_schema(tmp_path, 1, [("rental_id", "int64")])
+    write_schema(tmp_path, 2, [("rental_id", "int64"), ("title", "string")])
+    rental_codec = RentalCodec("msgpack", registry=LocalSchemaRegistry(str(tmp_path)))
+
+    payload = rental_codec.encode({"rental_id": 1, "title": "Academy Dinosaur"})
+
+    assert HEADER.unpack_from(payload) == (MAGIC_BYTE, 2)
+    assert RentalCodec.is_framed(payload)
+    assert not RentalCodec.is_framed(json.dumps(RENTAL).encode("utf-8"))
+    # Field names are not repeated in the binary payload
+    assert b"title" not in payload
+
+
+def test_messages_written_with_an_older_schema_still_decode(tmp_path):
+    write_schema(tmp_path, 1, [("rental_id", "int64")])
+    old = RentalCodec("msgpack", registry=LocalSchemaRegistry(str(tmp_path)))
+    old_payload = old.encode({"rental_id": 7})
+    write_schema(tmp_path, 2, [("rental_id", "int64"), ("title", "string")])
+    new = RentalCodec("msgpack", registry=LocalSchemaRegistry(str(tmp_path)))
+
+    assert new.decode(old_payload) == {"rental_id": 7}
+
+
+def test_unknown_schema_id_is_rejected():
+    rental_codec = RentalCodec("msgpack")
+    payload = HEADER.pack(MAGIC_BYTE, 999) + rental_codec.encode(RENTAL)[HEADER.size:]
+
+    with pytest.raises(ValueError, match="Unknown schema id 999"):
+        rental_codec.decode(payload)
+    with pytest.raises(ValueError, match="Unknown schema id 999"):
+        rental_codec.decode_batch([payload])
+
+
+def test_encode_rejects_fields_outside_the_schema():
+    with pytest.raises(ValueError, match="not in schema"):
+        RentalCodec("msgpack").encode({**RENTAL, "coupon": "SUMMER"})
+    with pytest.raises(ValueError, match="Unknown codec"):
+        RentalCodec("avro")
+
+
+def test_decode_batch_keeps_message_order_across_codecs():
+    as_json = RentalCodec("json")
+    as_msgpack = RentalCodec("msgpack")
+    payloads = [
+        as_msgpack.encode({**RENTAL, "rental_id": 1}),
+        as_json.encode({**RENTAL, "rental_id": 2}),
+        as_msgpack.encode({**RENTAL, "rental_id": 3, "return_date": "2005-05-29 22:53:30"}),
+    ]
+
+    table = as_msgpack.decode_batch(payloads)
+
+    assert table.column("rental_id").to_pylist() == [1, 2, 3]
+    assert table.schema.field("rental_rate").type == pa.float64()
+    assert table.column("return_date").to_pylist() == [None, None, "2005-05-29 22:53:30"]
+    assert as_msgpack.decode_batch([]).num_rows == 0
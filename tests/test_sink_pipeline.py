@@ -0,0 +1,163 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from sink_pipeline import CommitCoordinator, SinkWorker, enqueue
+
+TP = ("dvd_rentals", 0)
+
+
+class GatedSink:
+    """Fake sink: records batches, each write waits until the gate is open."""
+
+    def __init__(self, open_=True):
+        self.gate = threading.Event()
+        if open_:
+            self.gate.set()
+        self.written = []
+
+    def write(self, batch):
+        assert self.gate.wait(timeout=5)
+        self.written.append(batch)
+
+
+class FakeConsumer:
+    def __init__(self, on_poll=None, records=()):
+        self.on_poll = on_poll
+        self.records = list(records)
+        self.paused_partitions = set()
+        self.resumed = []
+        self.polls = 0
+
+    def assignment(self):
+        return {TP}
+
+    def pause(self, *partitions):
+        self.paused_partitions.update(partitions)
+
+    def paused(self):
+        return set(self.paused_partitions)
+
+    def resume(self, *partitions):
+        self.resumed.extend(partitions)
+        self.paused_partitions.difference_update(partitions)
+
+    def poll(self, timeout_ms=0):
+        self.polls += 1
+        if self.on_poll:
+            self.on_poll()
+        records, self.records = self.records, []
+        return {TP: records} if records else {}
+
+
+def start_workers(coordinator, sinks, queue_size=4):
+    workers = [SinkWorker(name, sink.write, coordinator, queue_size) for name, sink in sinks.items()]
+    for w in workers:
+        w.start()
+    return workers
+
+
+def stop_workers(workers):
+    for w in workers:
+        w.queue.put(None)
+    for w in workers:
+        w.join(timeout=5)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_offsets_are_committed_only_after_every_sink_acked():
+    s3, postgres = GatedSink(), GatedSink(open_=False)
+    coordinator = CommitCoordinator(["s3", "postgres"])
+    workers = start_workers(coordinator, {"s3": s3, "postgres": postgres})
+
+    for seq, last_offset in enumerate([9, 19]):
+        coordinator.register(seq, {TP: last_offset})
+        for w in workers:
+            w.queue.put((seq, ["event"] * 10))
+
+    wait_for(lambda: len(s3.written) == 2)
+    assert coordinator.acked["s3"] == 1
+    assert coordinator.ready_offsets() is None
+
+    postgres.gate.set()
+    wait_for(lambda: coordinator.frontier() == 1)
+    # Next offset to read, for everything both sinks wrote
+    assert coordinator.ready_offsets() == {TP: 20}
+    assert coordinator.ready_offsets() is None
+    assert coordinator.pending() == 0
+    stop_workers(workers)
+
+
+def test_failed_sink_never_lets_its_batch_commit():
+    def fail(batch):
+        raise IOError("bucket unreachable")
+
+    coordinator = CommitCoordinator(["s3", "postgres"])
+    s3 = SinkWorker("s3", fail, coordinator, 4)
+    postgres = SinkWorker("postgres", GatedSink().write, coordinator, 4)
+    s3.start()
+    postgres.start()
+    coordinator.register(0, {TP: 9})
+    for w in (s3, postgres):
+        w.queue.put((0, ["event"]))
+
+    s3.join(timeout=5)
+    wait_for(lambda: coordinator.acked["postgres"] == 0)
+    assert isinstance(s3.error, IOError)
+    assert coordinator.ready_offsets() is None
+    assert coordinator.pending() == 1
+    stop_workers([postgres])
+
+
+def test_enqueue_blocks_while_the_queue_is_full():
+    worker = SinkWorker("postgres", GatedSink().write, CommitCoordinator(["postgres"]), 1)
+    worker.queue.put((0, ["event"]))
+    item = (1, ["event"])
+    undelivered = {"postgres": item}
+    done = threading.Event()
+    consumer = FakeConsumer()
+
+    thread = threading.Thread(target=lambda: (enqueue(consumer, worker, item, undelivered, poll=False), done.set()))
+    thread.start()
+    assert not done.wait(timeout=0.7)
+    assert consumer.polls == 0
+
+    assert worker.queue.get() == (0, ["event"])
+    assert done.wait(timeout=5)
+    assert worker.queue.get() == item
+    assert undelivered == {}
+
+
+def test_enqueue_pauses_and_keeps_polling_while_the_sink_catches_up():
+    worker = SinkWorker("s3", GatedSink().write, CommitCoordinator(["s3"]), 1)
+    worker.queue.put((0, ["event"]))
+    item = (1, ["event"])
+    undelivered = {"s3": item}
+    # The sink frees its slot while the fetch stage is polling
+    consumer = FakeConsumer(on_poll=lambda: worker.queue.get_nowait(), records=["late record"])
+
+    received = enqueue(consumer, worker, item, undelivered)
+
+    assert received == ["late record"]
+    assert consumer.polls == 1
+    assert consumer.resumed == [TP] and not consumer.paused()
+    assert worker.queue.get_nowait() == item
+
+
+def test_enqueue_raises_when_the_blocked_sink_has_failed():
+    worker = SinkWorker("postgres", GatedSink().write, CommitCoordinator(["postgres"]), 1)
+    worker.queue.put((0, ["event"]))
+    worker.error = RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError, match="postgres sink failed"):
+        enqueue(FakeConsumer(), worker, (1, ["event"]), {"postgres": (1, ["event"])})